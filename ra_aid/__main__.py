@@ -207,6 +207,11 @@ Examples:
         action="store_false",
         help="Whether to disable token limiting for Anthropic Claude react agents. Token limiter removes older messages to prevent maximum token limit API errors.",
     )
+    parser.add_argument(
+        "--disable-expert-cache",
+        action="store_false",
+        help="Whether to disable reusing expert responses for identical expert queries within a session.",
+    )
     parser.add_argument(
         "--experimental-fallback-handler",
         action="store_true",
@@ -511,6 +516,7 @@ def main():
                         "web_research_enabled": web_research_enabled,
                         "initial_request": initial_request,
                         "limit_tokens": args.disable_limit_tokens,
+                        "expert_cache": args.disable_expert_cache,
                     }
 
                     # Store config in global memory
@@ -580,6 +586,7 @@ def main():
                     "aider_config": args.aider_config,
                     "use_aider": args.use_aider,
                     "limit_tokens": args.disable_limit_tokens,
+                    "expert_cache": args.disable_expert_cache,
                     "auto_test": args.auto_test,
                     "test_cmd": args.test_cmd,
                     "max_test_cmd_retries": args.max_test_cmd_retries,
@@ -1,31 +1,30 @@
 """Utility functions for working with agents."""
 
+import functools
 import os
+import re
 import signal
 import sys
 import threading
 import time
 import uuid
+from bisect import bisect_right
 from datetime import datetime
-from typing import Any, Dict, List, Literal, Optional, Sequence
+from itertools import accumulate
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple
 
-import litellm
 from anthropic import APIError, APITimeoutError, InternalServerError, RateLimitError
 from openai import RateLimitError as OpenAIRateLimitError
-from litellm.exceptions import RateLimitError as LiteLLMRateLimitError
-from google.api_core.exceptions import ResourceExhausted
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import (
     BaseMessage,
     HumanMessage,
     SystemMessage,
-    trim_messages,
 )
 from langchain_core.tools import tool
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import create_react_agent
 from langgraph.prebuilt.chat_agent_executor import AgentState
-from litellm import get_model_info
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.panel import Panel
@@ -66,7 +65,10 @@ from ra_aid.prompts.human_prompts import (
 )
 from ra_aid.prompts.implementation_prompts import IMPLEMENTATION_PROMPT
 from ra_aid.prompts.common_prompts import NEW_PROJECT_HINTS
-from ra_aid.prompts.planning_prompts import PLANNING_PROMPT
+from ra_aid.prompts.planning_prompts import (
+    PLANNING_PROMPT_DYNAMIC_TEMPLATE,
+    PLANNING_PROMPT_STATIC_TEMPLATE,
+)
 from ra_aid.prompts.research_prompts import (
     RESEARCH_ONLY_PROMPT,
     RESEARCH_PROMPT,
@@ -146,20 +148,78 @@ def state_modifier(
     if not messages:
         return []
 
+    # Estimate each message once; the first message is always kept
     first_message = messages[0]
-    remaining_messages = messages[1:]
-    first_tokens = estimate_messages_tokens([first_message])
-    new_max_tokens = max_input_tokens - first_tokens
-
-    trimmed_remaining = trim_messages(
-        remaining_messages,
-        token_counter=estimate_messages_tokens,
-        max_tokens=new_max_tokens,
-        strategy="last",
-        allow_partial=False,
+    new_max_tokens = max_input_tokens - estimate_messages_tokens([first_message])
+    estimate_tokens = CiaynAgent._estimate_tokens
+
+    # Running totals from the newest message backwards are non-decreasing, so the
+    # number of recent messages that fit the budget can be found by bisection
+    suffix_tokens = list(
+        accumulate(estimate_tokens(msg) for msg in reversed(messages[1:]))
     )
+    keep = bisect_right(suffix_tokens, new_max_tokens)
+
+    return [first_message] + (messages[-keep:] if keep else [])
+
+
+# Flattened view of models_params so fallback lookups are a single dict access
+_FLAT_TOKEN_LIMITS: Dict[Tuple[str, str], int] = {
+    (provider, model_name): params["token_limit"]
+    for provider, provider_models in models_params.items()
+    for model_name, params in provider_models.items()
+}
+
+
+def get_model_info(model: str) -> Dict[str, Any]:
+    """Get litellm model metadata, importing litellm on first use."""
+    from litellm import get_model_info as litellm_get_model_info
+
+    return litellm_get_model_info(model)
+
+
+@functools.lru_cache(maxsize=1024)
+def _litellm_token_limit(provider_model: str) -> Optional[int]:
+    """Look up a model's max input tokens in litellm, once per model.
+
+    Lookup failures are cached as None so the fallback path is only paid once.
+    """
+    from litellm.exceptions import NotFoundError
+
+    try:
+        return get_model_info(provider_model).get("max_input_tokens")
+    except NotFoundError:
+        logger.debug(
+            f"Model {provider_model} not found in litellm, falling back to models_params"
+        )
+    except Exception as e:
+        logger.debug(
+            f"Error getting model info from litellm: {e}, falling back to models_params"
+        )
+    return None
+
+
+def get_agent_provider_model(
+    config: Dict[str, Any], agent_type: Literal["default", "research", "planner"]
+) -> Tuple[str, str]:
+    """Resolve the provider and model an agent type runs on.
 
-    return [first_message] + trimmed_remaining
+    Research and planner agents use their own provider/model when configured and
+    fall back to the main provider/model otherwise.
+
+    Returns:
+        Tuple[str, str]: The provider and model name
+    """
+    if agent_type == "research":
+        provider = config.get("research_provider", "") or config.get("provider", "")
+        model_name = config.get("research_model", "") or config.get("model", "")
+    elif agent_type == "planner":
+        provider = config.get("planner_provider", "") or config.get("provider", "")
+        model_name = config.get("planner_model", "") or config.get("model", "")
+    else:
+        provider = config.get("provider", "")
+        model_name = config.get("model", "")
+    return provider, model_name
 
 
 def get_model_token_limit(
@@ -171,45 +231,25 @@ def get_model_token_limit(
         Optional[int]: The token limit if found, None otherwise
     """
     try:
-        if agent_type == "research":
-            provider = config.get("research_provider", "") or config.get("provider", "")
-            model_name = config.get("research_model", "") or config.get("model", "")
-        elif agent_type == "planner":
-            provider = config.get("planner_provider", "") or config.get("provider", "")
-            model_name = config.get("planner_model", "") or config.get("model", "")
-        else:
-            provider = config.get("provider", "")
-            model_name = config.get("model", "")
+        provider, model_name = get_agent_provider_model(config, agent_type)
 
-        try:
-            provider_model = model_name if not provider else f"{provider}/{model_name}"
-            model_info = get_model_info(provider_model)
-            max_input_tokens = model_info.get("max_input_tokens")
-            if max_input_tokens:
-                logger.debug(
-                    f"Using litellm token limit for {model_name}: {max_input_tokens}"
-                )
-                return max_input_tokens
-        except litellm.exceptions.NotFoundError:
-            logger.debug(
-                f"Model {model_name} not found in litellm, falling back to models_params"
-            )
-        except Exception as e:
+        provider_model = model_name if not provider else f"{provider}/{model_name}"
+        max_input_tokens = _litellm_token_limit(provider_model)
+        if max_input_tokens:
             logger.debug(
-                f"Error getting model info from litellm: {e}, falling back to models_params"
+                f"Using litellm token limit for {model_name}: {max_input_tokens}"
             )
+            return max_input_tokens
 
         # Fallback to models_params dict
         # Normalize model name for fallback lookup (e.g. claude-2 -> claude2)
         normalized_name = model_name.replace("-", "")
-        provider_tokens = models_params.get(provider, {})
-        if normalized_name in provider_tokens:
-            max_input_tokens = provider_tokens[normalized_name]["token_limit"]
+        max_input_tokens = _FLAT_TOKEN_LIMITS.get((provider, normalized_name))
+        if max_input_tokens is not None:
             logger.debug(
                 f"Found token limit for {provider}/{model_name}: {max_input_tokens}"
             )
         else:
-            max_input_tokens = None
             logger.debug(f"Could not find token limit for {provider}/{model_name}")
 
         return max_input_tokens
@@ -261,17 +301,23 @@ def is_anthropic_claude(config: Dict[str, Any]) -> bool:
     Returns:
         bool: True if this is an Anthropic Claude model
     """
-    provider = config.get("provider", "")
-    model_name = config.get("model", "")
-    result = (
-        provider.lower() == "anthropic"
-        and model_name
-        and "claude" in model_name.lower()
-    ) or (
-        provider.lower() == "openrouter"
-        and model_name.lower().startswith("anthropic/claude-")
+    return _is_anthropic_claude_model(
+        config.get("provider") or "", config.get("model") or ""
     )
-    return result
+
+
+@functools.lru_cache(maxsize=256)
+def _is_anthropic_claude_model(provider: str, model_name: str) -> bool:
+    """Cached provider/model check behind is_anthropic_claude."""
+    if not model_name:
+        return False
+    provider = provider.casefold()
+    model_name = model_name.casefold()
+    if provider == "anthropic":
+        return "claude" in model_name
+    if provider == "openrouter":
+        return model_name.startswith("anthropic/claude-")
+    return False
 
 
 def create_agent(
@@ -683,25 +729,23 @@ def run_planning_agent(
         logger.error(f"Failed to access research note repository: {str(e)}")
         formatted_research_notes = ""
     
-    planning_prompt = PLANNING_PROMPT.format(
-        current_date=current_date,
-        working_directory=working_directory,
+    planning_instructions = PLANNING_PROMPT_STATIC_TEMPLATE.safe_substitute(
         expert_section=expert_section,
         human_section=human_section,
         web_research_section=web_research_section,
-        base_task=base_task,
-        project_info=formatted_project_info,
-        research_notes=formatted_research_notes,
-        related_files="\n".join(get_related_files()),
-        key_facts=key_facts,
-        key_snippets=key_snippets,
-        work_log=get_memory_value("work_log"),
-        research_only_note=(
-            ""
-            if config.get("research_only")
-            else " Only request implementation if the user explicitly asked for changes to be made."
-        ),
     )
+    planning_values = {
+        "current_date": current_date,
+        "working_directory": working_directory,
+        "base_task": base_task,
+        "project_info": formatted_project_info,
+        "research_notes": formatted_research_notes,
+        "related_files": "\n".join(get_related_files()),
+        "key_facts": key_facts,
+        "key_snippets": key_snippets,
+        "work_log": get_memory_value("work_log"),
+    }
+    planning_prompt = PLANNING_PROMPT_DYNAMIC_TEMPLATE.safe_substitute(planning_values)
 
     config = _global_memory.get("config", {}) if not config else config
     recursion_limit = config.get("recursion_limit", DEFAULT_RECURSION_LIMIT)
@@ -717,7 +761,12 @@ def run_planning_agent(
         logger.debug("Planning agent completed successfully")
         none_or_fallback_handler = init_fallback_handler(agent, config, tools)
         _result = run_agent_with_retry(
-            agent, planning_prompt, run_config, none_or_fallback_handler
+            agent,
+            planning_prompt,
+            run_config,
+            none_or_fallback_handler,
+            static_prefix=planning_instructions,
+            agent_type="planner",
         )
         if _result:
             # Log planning completion
@@ -917,26 +966,29 @@ def _execute_test_command_wrapper(original_prompt, config, test_attempts, auto_t
     return execute_test_command(config, original_prompt, test_attempts, auto_test)
 
 
+# ValueErrors are only retried when they carry an error code or a rate limit phrase
+_RETRYABLE_VALUE_ERROR_RE = re.compile(
+    r"code|429|rate limit|too many requests|quota exceeded", re.IGNORECASE
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _lazy_rate_limit_errors() -> Tuple[type, ...]:
+    """Rate limit exceptions from heavy SDKs, imported when an error is first handled."""
+    from google.api_core.exceptions import ResourceExhausted
+    from litellm.exceptions import RateLimitError as LiteLLMRateLimitError
+
+    return (LiteLLMRateLimitError, ResourceExhausted)
+
+
 def _handle_api_error(e, attempt, max_retries, base_delay):
-    # 1. Check if this is a ValueError with 429 code or rate limit phrases
-    if isinstance(e, ValueError):
-        error_str = str(e).lower()
-        rate_limit_phrases = ["429", "rate limit", "too many requests", "quota exceeded"]
-        if "code" not in error_str and not any(phrase in error_str for phrase in rate_limit_phrases):
-            raise e
-    
-    # 2. Check for status_code or http_status attribute equal to 429
-    if hasattr(e, 'status_code') and e.status_code == 429:
+    # 1. Status code attributes identify rate limit errors without inspecting the message
+    if getattr(e, "status_code", None) == 429 or getattr(e, "http_status", None) == 429:
         pass  # This is a rate limit error, continue with retry logic
-    elif hasattr(e, 'http_status') and e.http_status == 429:
-        pass  # This is a rate limit error, continue with retry logic
-    # 3. Check for rate limit phrases in error message
-    elif isinstance(e, Exception) and not isinstance(e, ValueError):
-        error_str = str(e).lower()
-        if not any(phrase in error_str for phrase in ["rate limit", "too many requests", "quota exceeded", "429"]) and not ("rate" in error_str and "limit" in error_str):
-            # This doesn't look like a rate limit error, but we'll still retry other API errors
-            pass
-    
+    # 2. Re-raise ValueErrors that carry neither an error code nor a rate limit phrase
+    elif isinstance(e, ValueError) and not _RETRYABLE_VALUE_ERROR_RE.search(str(e)):
+        raise e
+
     # Apply common retry logic for all identified errors
     if attempt == max_retries - 1:
         logger.error("Max retries reached, failing: %s", str(e))
@@ -995,6 +1047,49 @@ def _handle_fallback_response(
         msg_list.extend(msg_list_response)
 
 
+def build_prompt_messages(
+    prompt: str,
+    config: Dict[str, Any],
+    static_prefix: Optional[str] = None,
+    agent_type: Literal["default", "research", "planner"] = "default",
+) -> list[BaseMessage]:
+    """Build the initial message list for an agent run.
+
+    When a static prefix is given it is placed ahead of the per-run prompt so the
+    start of the request stays byte-identical across turns. Anthropic Claude models
+    get an explicit ephemeral cache_control checkpoint on the prefix; other
+    providers rely on their automatic prefix caching.
+
+    Args:
+        prompt: The per-run prompt text
+        config: Configuration dictionary used to detect the provider/model
+        static_prefix: Optional instructions that do not change between runs
+        agent_type: Agent whose provider/model receives the prompt
+
+    Returns:
+        list[BaseMessage]: A single human message carrying the full prompt
+    """
+    if not static_prefix:
+        return [HumanMessage(content=prompt)]
+
+    provider, model_name = get_agent_provider_model(config, agent_type)
+    if _is_anthropic_claude_model(provider, model_name):
+        return [
+            HumanMessage(
+                content=[
+                    {
+                        "type": "text",
+                        "text": static_prefix,
+                        "cache_control": {"type": "ephemeral"},
+                    },
+                    {"type": "text", "text": prompt},
+                ]
+            )
+        ]
+
+    return [HumanMessage(content=f"{static_prefix}\n{prompt}")]
+
+
 def _run_agent_stream(agent: RAgents, msg_list: list[BaseMessage], config: dict):
     for chunk in agent.stream({"messages": msg_list}, config):
         logger.debug("Agent output: %s", chunk)
@@ -1011,8 +1106,15 @@ def run_agent_with_retry(
     prompt: str,
     config: dict,
     fallback_handler: Optional[FallbackHandler] = None,
+    static_prefix: Optional[str] = None,
+    agent_type: Literal["default", "research", "planner"] = "default",
 ) -> Optional[str]:
-    """Run an agent with retry logic for API errors."""
+    """Run an agent with retry logic for API errors.
+
+    If static_prefix is provided it is sent ahead of the prompt as a cacheable
+    block (see build_prompt_messages).
+    """
+    msg_list = build_prompt_messages(prompt, config, static_prefix, agent_type)
     logger.debug("Running agent with prompt length: %d", len(prompt))
     original_handler = _setup_interrupt_handling()
     max_retries = 20
@@ -1021,7 +1123,6 @@ def run_agent_with_retry(
     _max_test_retries = config.get("max_test_cmd_retries", DEFAULT_MAX_TEST_CMD_RETRIES)
     auto_test = config.get("auto_test", False)
     original_prompt = prompt
-    msg_list = [HumanMessage(content=prompt)]
 
     # Create a new agent context for this run
     with InterruptibleSection(), agent_context() as ctx:
@@ -1079,8 +1180,7 @@ def run_agent_with_retry(
                     APITimeoutError,
                     RateLimitError,
                     OpenAIRateLimitError,
-                    LiteLLMRateLimitError,
-                    ResourceExhausted,
+                    *_lazy_rate_limit_errors(),
                     APIError,
                     ValueError,
                 ) as e:
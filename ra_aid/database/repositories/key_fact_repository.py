@@ -119,6 +119,7 @@ class KeyFactRepository:
         if db is None:
             raise ValueError("Database connection is required for KeyFactRepository")
         self.db = db
+        self._revision = 0
     
     def create(self, content: str, human_input_id: Optional[int] = None) -> KeyFact:
         """
@@ -137,6 +138,7 @@ class KeyFactRepository:
         try:
             fact = KeyFact.create(content=content, human_input_id=human_input_id)
             logger.debug(f"Created key fact ID {fact.id}: {content}")
+            self._revision += 1
             return fact
         except peewee.DatabaseError as e:
             logger.error(f"Failed to create key fact: {str(e)}")
@@ -186,6 +188,7 @@ class KeyFactRepository:
             fact.content = content
             fact.save()
             logger.debug(f"Updated key fact ID {fact_id}: {content}")
+            self._revision += 1
             return fact
         except peewee.DatabaseError as e:
             logger.error(f"Failed to update key fact {fact_id}: {str(e)}")
@@ -214,11 +217,25 @@ class KeyFactRepository:
             # Delete the fact
             fact.delete_instance()
             logger.debug(f"Deleted key fact ID {fact_id}")
+            self._revision += 1
             return True
         except peewee.DatabaseError as e:
             logger.error(f"Failed to delete key fact {fact_id}: {str(e)}")
             raise
     
+    def get_revision(self) -> int:
+        """
+        Get the revision counter for this repository.
+
+        The counter is incremented by every successful create, update or delete
+        made through this repository, so callers can cheaply tell whether data
+        derived from the stored key facts is still current.
+
+        Returns:
+            int: The current revision number
+        """
+        return self._revision
+    
     def get_all(self) -> List[KeyFact]:
         """
         Retrieve all key facts from the database.
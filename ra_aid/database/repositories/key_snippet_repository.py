@@ -128,6 +128,7 @@ class KeySnippetRepository:
         if db is None:
             raise ValueError("Database connection is required for KeySnippetRepository")
         self.db = db
+        self._revision = 0
     
     def create(
         self, filepath: str, line_number: int, snippet: str, description: Optional[str] = None,
@@ -158,6 +159,7 @@ class KeySnippetRepository:
                 human_input_id=human_input_id
             )
             logger.debug(f"Created key snippet ID {key_snippet.id}: {filepath}:{line_number}")
+            self._revision += 1
             return key_snippet
         except peewee.DatabaseError as e:
             logger.error(f"Failed to create key snippet: {str(e)}")
@@ -220,6 +222,7 @@ class KeySnippetRepository:
             key_snippet.description = description
             key_snippet.save()
             logger.debug(f"Updated key snippet ID {snippet_id}: {filepath}:{line_number}")
+            self._revision += 1
             return key_snippet
         except peewee.DatabaseError as e:
             logger.error(f"Failed to update key snippet {snippet_id}: {str(e)}")
@@ -248,11 +251,25 @@ class KeySnippetRepository:
             # Delete the snippet
             key_snippet.delete_instance()
             logger.debug(f"Deleted key snippet ID {snippet_id}")
+            self._revision += 1
             return True
         except peewee.DatabaseError as e:
             logger.error(f"Failed to delete key snippet {snippet_id}: {str(e)}")
             raise
     
+    def get_revision(self) -> int:
+        """
+        Get the revision counter for this repository.
+
+        The counter is incremented by every successful create, update or delete
+        made through this repository, so callers can cheaply tell whether data
+        derived from the stored key snippets is still current.
+
+        Returns:
+            int: The current revision number
+        """
+        return self._revision
+    
     def get_all(self) -> List[KeySnippet]:
         """
         Retrieve all key snippets from the database.
@@ -119,6 +119,7 @@ class ResearchNoteRepository:
         if db is None:
             raise ValueError("Database connection is required for ResearchNoteRepository")
         self.db = db
+        self._revision = 0
     
     def create(self, content: str, human_input_id: Optional[int] = None) -> ResearchNote:
         """
@@ -137,6 +138,7 @@ class ResearchNoteRepository:
         try:
             note = ResearchNote.create(content=content, human_input_id=human_input_id)
             logger.debug(f"Created research note ID {note.id}: {content[:50]}...")
+            self._revision += 1
             return note
         except peewee.DatabaseError as e:
             logger.error(f"Failed to create research note: {str(e)}")
@@ -186,6 +188,7 @@ class ResearchNoteRepository:
             note.content = content
             note.save()
             logger.debug(f"Updated research note ID {note_id}: {content[:50]}...")
+            self._revision += 1
             return note
         except peewee.DatabaseError as e:
             logger.error(f"Failed to update research note {note_id}: {str(e)}")
@@ -214,11 +217,25 @@ class ResearchNoteRepository:
             # Delete the note
             note.delete_instance()
             logger.debug(f"Deleted research note ID {note_id}")
+            self._revision += 1
             return True
         except peewee.DatabaseError as e:
             logger.error(f"Failed to delete research note {note_id}: {str(e)}")
             raise
     
+    def get_revision(self) -> int:
+        """
+        Get the revision counter for this repository.
+
+        The counter is incremented by every successful create, update or delete
+        made through this repository, so callers can cheaply tell whether data
+        derived from the stored research notes is still current.
+
+        Returns:
+            int: The current revision number
+        """
+        return self._revision
+    
     def get_all(self) -> List[ResearchNote]:
         """
         Retrieve all research notes from the database.
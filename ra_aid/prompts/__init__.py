@@ -46,7 +46,12 @@ from ra_aid.prompts.research_prompts import (
 )
 
 # Planning prompts
-from ra_aid.prompts.planning_prompts import PLANNING_PROMPT
+from ra_aid.prompts.planning_prompts import (
+    PLANNING_PROMPT,
+    PLANNING_PROMPT_STATIC_PREFIX,
+    PLANNING_PROMPT_STATIC_TEMPLATE,
+    PLANNING_PROMPT_DYNAMIC_TEMPLATE,
+)
 
 # Implementation prompts
 from ra_aid.prompts.implementation_prompts import IMPLEMENTATION_PROMPT
@@ -92,6 +97,9 @@ __all__ = [
     
     # Planning prompts
     "PLANNING_PROMPT",
+    "PLANNING_PROMPT_STATIC_PREFIX",
+    "PLANNING_PROMPT_STATIC_TEMPLATE",
+    "PLANNING_PROMPT_DYNAMIC_TEMPLATE",
     
     # Implementation prompts
     "IMPLEMENTATION_PROMPT",
@@ -2,42 +2,20 @@
 This module contains prompts related to planning tasks.
 """
 
+import re
+from string import Template
+
 from ra_aid.prompts.expert_prompts import EXPERT_PROMPT_SECTION_PLANNING
 from ra_aid.prompts.human_prompts import HUMAN_PROMPT_SECTION_PLANNING
 from ra_aid.prompts.web_research_prompts import WEB_RESEARCH_PROMPT_SECTION_PLANNING
 
 # Planning stage prompt - guides task breakdown and implementation planning
 # Includes a directive to scale complexity with request size and consult the expert (if available) for logic verification and debugging.
-PLANNING_PROMPT = """Current Date: {current_date}
-Working Directory: {working_directory}
-
-<base task>
-{base_task}
-<base task>
-
-KEEP IT SIMPLE
-
-Project Info:
-{project_info}
-
-Research Notes:
-<notes>
-{research_notes}
-</notes>
-
-Relevant Files:
-{related_files}
-
-Key Facts:
-{key_facts}
-
-Key Snippets:
-{key_snippets}
-
-Work done so far:
-<work log>
-{work_log}
-</work log>
+#
+# The prompt is split in two so the instructions form a stable prefix ahead of the
+# per-run data. The static prefix only varies with the expert/human/web flags, which
+# are fixed for a session, so providers with prompt caching can reuse it across turns.
+PLANNING_PROMPT_STATIC_PREFIX = """KEEP IT SIMPLE
 
 Guidelines:
 
@@ -83,4 +61,53 @@ DO NOT WRITE ANY FILES YET. CODE WILL BE WRITTEN AS YOU CALL request_task_implem
 DO NOT USE run_shell_command TO WRITE ANY FILE CONTENTS! USE request_task_implementation.
 
 NEVER ANNOUNCE WHAT YOU ARE DOING, JUST DO IT!
-"""
\ No newline at end of file
+"""
+
+PLANNING_PROMPT_DYNAMIC_SUFFIX = """Current Date: {current_date}
+Working Directory: {working_directory}
+
+<base task>
+{base_task}
+<base task>
+
+Project Info:
+{project_info}
+
+Research Notes:
+<notes>
+{research_notes}
+</notes>
+
+Relevant Files:
+{related_files}
+
+Key Facts:
+{key_facts}
+
+Key Snippets:
+{key_snippets}
+
+Work done so far:
+<work log>
+{work_log}
+</work log>
+"""
+
+PLANNING_PROMPT = PLANNING_PROMPT_STATIC_PREFIX + "\n" + PLANNING_PROMPT_DYNAMIC_SUFFIX
+
+
+def _compile_template(prompt: str) -> Template:
+    """Convert a str.format style prompt into a string.Template."""
+
+    def replace(match: "re.Match[str]") -> str:
+        if match.group(1):
+            return "${" + match.group(1) + "}"
+        return match.group(0)[0]
+
+    escaped = prompt.replace("$", "$$")
+    return Template(re.sub(r"\{(\w+)\}|\{\{|\}\}", replace, escaped))
+
+
+# Precompiled templates used to render the planning prompt with safe_substitute
+PLANNING_PROMPT_STATIC_TEMPLATE = _compile_template(PLANNING_PROMPT_STATIC_PREFIX)
+PLANNING_PROMPT_DYNAMIC_TEMPLATE = _compile_template(PLANNING_PROMPT_DYNAMIC_SUFFIX)
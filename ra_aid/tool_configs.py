@@ -2,6 +2,7 @@ from langchain_core.tools import BaseTool
 
 from ra_aid.tools import (
     ask_expert,
+    ask_experts_batch,
     ask_human,
     emit_expert_context,
     emit_key_facts,
@@ -112,7 +113,7 @@ READ_ONLY_TOOLS = get_read_only_tools(use_aider=_config.get("use_aider", False))
 # MODIFICATION_TOOLS will be set dynamically based on config, default defined here
 MODIFICATION_TOOLS = [file_str_replace, put_complete_file_contents]
 COMMON_TOOLS = get_read_only_tools(use_aider=_config.get("use_aider", False))
-EXPERT_TOOLS = [emit_expert_context, ask_expert]
+EXPERT_TOOLS = [emit_expert_context, ask_expert, ask_experts_batch]
 RESEARCH_TOOLS = [
     emit_research_notes,
     # *TEMPORARILY* disabled to improve tool calling perf.
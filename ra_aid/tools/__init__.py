@@ -1,4 +1,4 @@
-from .expert import ask_expert, emit_expert_context
+from .expert import ask_expert, ask_experts_batch, emit_expert_context
 from .file_str_replace import file_str_replace
 from .fuzzy_find import fuzzy_find_project_files
 from .human import ask_human
@@ -28,6 +28,7 @@ from .write_file import put_complete_file_contents
 
 __all__ = [
     "ask_expert",
+    "ask_experts_batch",
     "web_search_tavily",
     "deregister_related_files",
     "emit_expert_context",
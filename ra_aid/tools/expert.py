@@ -1,13 +1,22 @@
+import functools
+import hashlib
+import io
 import os
+import threading
 import logging
-from typing import List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from langchain_core.tools import tool
 from rich.console import Console
+from rich.live import Live
 from rich.markdown import Markdown
 from rich.panel import Panel
-
-logger = logging.getLogger(__name__)
+from rich.text import Text
 
 from ..database.repositories.key_fact_repository import get_key_fact_repository
 from ..database.repositories.key_snippet_repository import get_key_snippet_repository
@@ -18,20 +27,58 @@ from ..model_formatters.key_snippets_formatter import format_key_snippets_dict
 from ..model_formatters.research_notes_formatter import format_research_notes_dict
 from .memory import _global_memory, get_memory_value
 
+logger = logging.getLogger(__name__)
+
 console = Console()
-_model = None
+# The expert client and the (provider, model) key it was built for, stored as one
+# tuple so both are always read and replaced together
+_model_entry: Optional[Tuple[Tuple[Optional[str], Optional[str]], Any]] = None
+_model_lock = threading.Lock()
+# Held by the expert call that owns the live response display
+_live_lock = threading.Lock()
+
+# Files larger than this are read line by line instead of in a single call
+MAX_BULK_READ_BYTES = 10 * 1024 * 1024
+# Upper bound on threads used to read related files concurrently
+MAX_READ_WORKERS = 16
+
+# Concatenated contents of recently read related file sets
+RELATED_FILES_CACHE_SIZE = 8
+_related_files_cache: Dict[tuple, str] = {}
+_related_files_cache_lock = threading.Lock()
+
+# Formatted repository contents by section: (repository, revision, formatted text)
+_formatted_sections: Dict[str, Tuple[object, int, str]] = {}
+
+# Maximum number of batched expert questions sent to the provider at once
+EXPERT_BATCH_MAX_CONCURRENCY = 5
+
+# Responses to previously asked expert queries, keyed by a hash of the full query
+EXPERT_RESPONSE_CACHE_SIZE = 128
+_expert_response_cache: "OrderedDict[str, str]" = OrderedDict()
+_expert_response_cache_lock = threading.Lock()
 
 
 def get_model():
-    global _model
+    global _model_entry
     try:
-        if _model is None:
-            config = _global_memory["config"]
-            provider = config.get("expert_provider") or config.get("provider")
-            model = config.get("expert_model") or config.get("model")
-            _model = initialize_expert_llm(provider, model)
+        config = _global_memory["config"]
+        provider = config.get("expert_provider") or config.get("provider")
+        model = config.get("expert_model") or config.get("model")
+        key = (provider, model)
+        entry = _model_entry
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        with _model_lock:
+            # Another thread may have initialized the model while we waited
+            entry = _model_entry
+            if entry is None or entry[0] != key:
+                entry = (key, initialize_expert_llm(provider, model))
+                _model_entry = entry
+            return entry[1]
     except Exception as e:
-        _model = None
+        with _model_lock:
+            _model_entry = None
         console.print(
             Panel(
                 f"Failed to initialize expert model: {e}",
@@ -40,14 +87,181 @@ def get_model():
             )
         )
         raise
-    return _model
+
+
+def _expert_is_anthropic_claude() -> bool:
+    """Check whether the configured expert model is an Anthropic Claude model."""
+    from ..agent_utils import is_anthropic_claude
+
+    config = _global_memory.get("config", {})
+    return is_anthropic_claude(
+        {
+            "provider": config.get("expert_provider") or config.get("provider") or "",
+            "model": config.get("expert_model") or config.get("model") or "",
+        }
+    )
+
+
+def _join_query(query_prefix: str, additional_context: str, question_text: str) -> str:
+    """Join the parts of an expert query into the full query text."""
+    return "\n".join(
+        part for part in (query_prefix, additional_context, question_text) if part
+    )
+
+
+def build_expert_input(
+    query_prefix: str, question_text: str, additional_context: str = ""
+) -> Union[str, List[BaseMessage]]:
+    """Build the model input for an expert query.
+
+    The static prefix always precedes the question so repeated queries share a
+    common prefix. Anthropic Claude models get the prefix as a system block with an
+    ephemeral cache_control checkpoint, followed by the per-question additional
+    context in its own uncached block; other providers receive a single string.
+
+    Args:
+        query_prefix: Context shared between expert queries
+        question_text: The question section of the query
+        additional_context: Context emitted for this question only
+
+    Returns:
+        A message list for Anthropic Claude models, otherwise the full query string
+    """
+    if _expert_is_anthropic_claude():
+        system_content = [
+            {
+                "type": "text",
+                "text": query_prefix,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+        if additional_context:
+            system_content.append({"type": "text", "text": additional_context})
+        return [
+            SystemMessage(content=system_content),
+            HumanMessage(content=question_text),
+        ]
+
+    return _join_query(query_prefix, additional_context, question_text)
+
+
+def _expert_cache_key(full_query: str) -> str:
+    return hashlib.blake2b(full_query.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_cached_expert_response(full_query: str) -> Optional[str]:
+    """Return a previously cached expert response for this exact query, if any."""
+    key = _expert_cache_key(full_query)
+    with _expert_response_cache_lock:
+        if key not in _expert_response_cache:
+            return None
+        _expert_response_cache.move_to_end(key)
+        return _expert_response_cache[key]
+
+
+def cache_expert_response(full_query: str, response: str) -> None:
+    """Store an expert response, evicting the least recently used entry when full."""
+    key = _expert_cache_key(full_query)
+    with _expert_response_cache_lock:
+        _expert_response_cache[key] = response
+        if len(_expert_response_cache) > EXPERT_RESPONSE_CACHE_SIZE:
+            _expert_response_cache.popitem(last=False)
+
+
+def _format_repository_section(
+    name: str,
+    repository,
+    fetch: Callable[[], dict],
+    formatter: Callable[[dict], str],
+) -> str:
+    """Format a repository's contents, reusing the last result if nothing changed.
+
+    Args:
+        name: Cache slot for this section
+        repository: Repository exposing get_revision()
+        fetch: Callable returning the repository contents as a dict
+        formatter: Callable formatting that dict for the prompt
+
+    Returns:
+        The formatted section text
+    """
+    revision = repository.get_revision()
+    cached = _formatted_sections.get(name)
+    if cached and cached[0] is repository and cached[1] == revision:
+        return cached[2]
+
+    formatted = formatter(fetch())
+    _formatted_sections[name] = (repository, revision, formatted)
+    return formatted
+
+
+def _chunk_text(content: Union[str, list]) -> str:
+    """Extract the text from a streamed message chunk's content."""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block.get("text", "")
+        for block in content
+        if isinstance(block, dict) and block.get("type") == "text"
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def _md(text: str) -> Markdown:
+    """Parse text into a Markdown renderable, reusing recent parses."""
+    return Markdown(text)
+
+
+def stream_expert_response(expert_input: Union[str, List[BaseMessage]]) -> str:
+    """Stream the expert model's response, rendering it as it arrives.
+
+    Args:
+        expert_input: The model input built by build_expert_input
+
+    Returns:
+        The complete response text
+    """
+    # rich allows one live display per console; when another expert call (e.g. a
+    # parallel tool call) is already streaming, print the response once complete
+    if not _live_lock.acquire(blocking=False):
+        response = "".join(
+            _chunk_text(chunk.content) for chunk in get_model().stream(expert_input)
+        )
+        console.print(Panel(_md(response), title="Expert Response", border_style="blue"))
+        return response
+
+    try:
+        buf = []
+        with Live(
+            Panel(Text(""), title="Expert Response", border_style="blue"),
+            console=console,
+            refresh_per_second=8,
+        ) as live:
+            # Show raw text while streaming and only parse Markdown once at the end
+            for chunk in get_model().stream(expert_input):
+                buf.append(_chunk_text(chunk.content))
+                live.update(
+                    Panel(Text("".join(buf)), title="Expert Response", border_style="blue")
+                )
+            response = "".join(buf)
+            live.update(Panel(_md(response), title="Expert Response", border_style="blue"))
+        return response
+    finally:
+        _live_lock.release()
+
+
+@dataclass
+class ExpertContext:
+    """Additional context collected for the next expert question."""
+
+    # Additional textual context, keyed by content hash
+    text: Dict[bytes, str] = field(default_factory=dict)
+    # File paths to include
+    files: List[str] = field(default_factory=list)
 
 
 # Keep track of context globally
-expert_context = {
-    "text": [],  # Additional textual context
-    "files": [],  # File paths to include
-}
+expert_context = ExpertContext()
 
 
 @tool("emit_expert_context")
@@ -67,7 +281,17 @@ def emit_expert_context(context: str) -> str:
     Args:
         context: The context to add
     """
-    expert_context["text"].append(context)
+    key = hashlib.blake2b(context.encode("utf-8"), digest_size=12).digest()
+    if key in expert_context.text:
+        console.print(
+            Panel(
+                "Expert context already added, skipping duplicate",
+                title="Expert Context",
+                border_style="blue",
+            )
+        )
+        return "Context already added."
+    expert_context.text[key] = context
 
     # Create and display status panel
     panel_content = f"Added expert context ({len(context)} characters)"
@@ -76,6 +300,46 @@ def emit_expert_context(context: str) -> str:
     return "Context added."
 
 
+def _dedupe_context_texts(texts: List[str]) -> List[str]:
+    """Drop context entries that are fully contained in a longer entry.
+
+    The surviving entries keep their original emission order.
+    """
+    kept: List[str] = []
+    for text in sorted(texts, key=len, reverse=True):
+        if not any(text in longer for longer in kept):
+            kept.append(text)
+    kept_ids = {id(text) for text in kept}
+    return [text for text in texts if id(text) in kept_ids]
+
+
+def _read_file_lines(path: str, max_lines: int) -> Optional[Tuple[str, int]]:
+    """Read a single file for read_files_with_limit.
+
+    Returns:
+        None if the file does not exist, otherwise a tuple of the file text and its
+        line count. Files too large to read in one call only return their first
+        max_lines + 1 lines, so callers can still detect truncation
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    if st.st_size > MAX_BULK_READ_BYTES:
+        with open(path, "r", encoding="utf-8") as f:
+            # Avoid loading huge files; only pull the lines within budget
+            lines = list(islice(f, max_lines + 1))
+        return "".join(lines), len(lines)
+
+    # Text mode keeps universal newline translation, matching the large file path
+    with open(path, "r", encoding="utf-8") as f:
+        data = f.read()
+    # Count "\n" only, like file iteration; a final line without a newline counts too
+    line_count = data.count("\n") + (not data.endswith("\n")) if data else 0
+    return data, line_count
+
+
 def read_files_with_limit(file_paths: List[str], max_lines: int = 10000) -> str:
     """Read multiple files and concatenate contents, stopping at line limit.
 
@@ -84,39 +348,67 @@ def read_files_with_limit(file_paths: List[str], max_lines: int = 10000) -> str:
         max_lines: Maximum total lines to read (default: 10000)
 
     Note:
+        - Files are read concurrently but concatenated in the given order
         - Each file's contents will be prefaced with its path as a header
-        - Stops reading files when max_lines limit is reached
+        - Stops reading files when max_lines limit is reached; files left over
+          are still listed by header with a truncation note
         - Files that would exceed the line limit are truncated
     """
-    total_lines = 0
-    contents = []
+    if not file_paths:
+        return ""
 
-    for path in file_paths:
-        try:
-            if not os.path.exists(path):
-                console.print(f"Warning: File not found: {path}", style="yellow")
+    total_lines = 0
+    buf = io.StringIO()
+    truncated_note = f"\n... truncated after {max_lines} lines ..."
+    workers = min(MAX_READ_WORKERS, len(file_paths))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Read one wave of files per worker at a time, each limited to the budget
+        # left when the wave starts, so nothing is read once the budget is spent
+        for start in range(0, len(file_paths), workers):
+            wave = file_paths[start : start + workers]
+            if total_lines >= max_lines:
+                for path in wave:
+                    buf.write(f"\n## File: {path}\n{truncated_note}")
                 continue
 
-            with open(path, "r", encoding="utf-8") as f:
-                file_content = []
-                for i, line in enumerate(f):
-                    if total_lines + i >= max_lines:
-                        file_content.append(
-                            f"\n... truncated after {max_lines} lines ..."
-                        )
-                        break
-                    file_content.append(line)
-
-                if file_content:
-                    contents.append(f"\n## File: {path}\n")
-                    contents.append("".join(file_content))
-                    total_lines += len(file_content)
-
-        except Exception as e:
-            console.print(f"Error reading file {path}: {str(e)}", style="red")
-            continue
-
-    return "".join(contents)
+            wave_budget = max_lines - total_lines
+            futures = [
+                executor.submit(_read_file_lines, path, wave_budget) for path in wave
+            ]
+
+            for path, future in zip(wave, futures):
+                if total_lines >= max_lines:
+                    future.cancel()
+                    buf.write(f"\n## File: {path}\n{truncated_note}")
+                    continue
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    console.print(f"Error reading file {path}: {str(e)}", style="red")
+                    continue
+
+                if result is None:
+                    console.print(f"Warning: File not found: {path}", style="yellow")
+                    continue
+
+                data, line_count = result
+                if not line_count:
+                    continue
+
+                buf.write(f"\n## File: {path}\n")
+                remaining = max_lines - total_lines
+                if line_count > remaining:
+                    # Split only when the file actually needs truncating
+                    buf.writelines(islice(io.StringIO(data), remaining))
+                    buf.write(truncated_note)
+                    total_lines = max_lines
+                else:
+                    buf.write(data)
+                    total_lines += line_count
+
+    return buf.getvalue()
 
 
 def read_related_files(file_paths: List[str]) -> str:
@@ -131,103 +423,210 @@ def read_related_files(file_paths: List[str]) -> str:
     if not file_paths:
         return ""
 
-    return read_files_with_limit(file_paths, max_lines=10000)
-
-
-@tool("ask_expert")
-def ask_expert(question: str) -> str:
-    """Ask a question to an expert AI model.
-
-    Keep your questions specific, but long and detailed.
+    # Files are identified by path, modification time and size so that any
+    # change on disk invalidates the cached contents
+    key = []
+    for path in file_paths:
+        try:
+            st = os.stat(path)
+            key.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            key.append((path, None, None))
+    key = tuple(key)
 
-    You only query the expert when you have a specific question in mind.
+    with _related_files_cache_lock:
+        cached = _related_files_cache.get(key)
+    if cached is not None:
+        return cached
 
-    The expert can be extremely useful at logic questions, debugging, and reviewing complex source code, but you must provide all context including source manually.
+    contents = read_files_with_limit(file_paths, max_lines=10000)
+    with _related_files_cache_lock:
+        _related_files_cache[key] = contents
+        if len(_related_files_cache) > RELATED_FILES_CACHE_SIZE:
+            _related_files_cache.pop(next(iter(_related_files_cache)), None)
+    return contents
 
-    The expert can see any key facts and code snippets previously noted, along with any additional context you've provided.
-      But the expert cannot see or reason about anything you have not explicitly provided in this way.
 
-    Try to phrase your question in a way that it does not expand the scope of our top-level task.
+def build_expert_query_prefix() -> Tuple[str, str]:
+    """Build the context shared by expert questions and reset the expert context.
 
-    The expert can be prone to overthinking depending on what and how you ask it.
+    Returns:
+        A tuple of the static query prefix (requirements, key facts, key snippets,
+        research notes and related files) and the additional context section, which
+        is empty when no context was emitted
     """
-    global expert_context
-
     # Get all content first
     file_paths = list(_global_memory["related_files"].values())
     related_contents = read_related_files(file_paths)
     # Get key snippets directly from repository and format using the formatter
     try:
-        key_snippets = format_key_snippets_dict(get_key_snippet_repository().get_snippets_dict())
+        repository = get_key_snippet_repository()
+        key_snippets = _format_repository_section(
+            "key_snippets",
+            repository,
+            repository.get_snippets_dict,
+            format_key_snippets_dict,
+        )
     except RuntimeError as e:
         logger.error(f"Failed to access key snippet repository: {str(e)}")
         key_snippets = ""
     # Get key facts directly from repository and format using the formatter
     try:
-        facts_dict = get_key_fact_repository().get_facts_dict()
-        key_facts = format_key_facts_dict(facts_dict)
+        repository = get_key_fact_repository()
+        key_facts = _format_repository_section(
+            "key_facts", repository, repository.get_facts_dict, format_key_facts_dict
+        )
     except RuntimeError as e:
         logger.error(f"Failed to access key fact repository: {str(e)}")
         key_facts = ""
     # Get research notes directly from repository and format using the formatter
     try:
         repository = get_research_note_repository()
-        notes_dict = repository.get_notes_dict()
-        formatted_research_notes = format_research_notes_dict(notes_dict)
+        formatted_research_notes = _format_repository_section(
+            "research_notes",
+            repository,
+            repository.get_notes_dict,
+            format_research_notes_dict,
+        )
     except RuntimeError as e:
         logger.error(f"Failed to access research note repository: {str(e)}")
         formatted_research_notes = ""
 
+    # Capture and clear the additional context now that it is part of the query
+    expert_context_text = "\n".join(
+        _dedupe_context_texts(list(expert_context.text.values()))
+    )
+    expert_context.text.clear()
+    expert_context.files.clear()
+
+    # Build the static part of the query first, ordered from least to most
+    # volatile, so successive expert queries share the longest possible prefix.
+    query_parts = [
+        "# Additional Requirements",
+        "**DO NOT OVERTHINK**",
+        "**DO NOT OVERCOMPLICATE**",
+    ]
+
+    if key_facts and len(key_facts) > 0:
+        query_parts.extend(["# Key Facts About This Project", key_facts])
+
+    if key_snippets and len(key_snippets) > 0:
+        query_parts.extend(["# Key Snippets", key_snippets])
+
+    if formatted_research_notes:
+        query_parts.extend(["# Research Notes", formatted_research_notes])
+
+    if related_contents:
+        query_parts.extend(["# Related Files", related_contents])
+
+    # The additional context is re-emitted for almost every question, so it is kept
+    # apart from the static prefix and only placed between it and the question
+    additional_context = (
+        f"\n# Additional Context\n{expert_context_text}" if expert_context_text else ""
+    )
+
+    return "\n".join(query_parts), additional_context
+
+
+@tool("ask_expert")
+def ask_expert(question: str) -> str:
+    """Ask a question to an expert AI model.
+
+    Keep your questions specific, but long and detailed.
+
+    You only query the expert when you have a specific question in mind.
+
+    The expert can be extremely useful at logic questions, debugging, and reviewing complex source code, but you must provide all context including source manually.
+
+    The expert can see any key facts and code snippets previously noted, along with any additional context you've provided.
+      But the expert cannot see or reason about anything you have not explicitly provided in this way.
+
+    Try to phrase your question in a way that it does not expand the scope of our top-level task.
+
+    The expert can be prone to overthinking depending on what and how you ask it.
+    """
     # Build display query (just question)
     display_query = "# Question\n" + question
 
     # Show only question in panel
     console.print(
-        Panel(Markdown(display_query), title="🤔 Expert Query", border_style="yellow")
+        Panel(_md(display_query), title="🤔 Expert Query", border_style="yellow")
     )
 
-    # Clear context after panel display
-    expert_context["text"].clear()
-    expert_context["files"].clear()
+    query_prefix, additional_context = build_expert_query_prefix()
 
-    # Build full query in specified order
-    query_parts = []
+    # Get response using full query, reusing the answer if it was already asked
+    full_query = _join_query(query_prefix, additional_context, display_query)
+    use_cache = _global_memory.get("config", {}).get("expert_cache", True)
+    content = get_cached_expert_response(full_query) if use_cache else None
+    if content is None:
+        content = stream_expert_response(
+            build_expert_input(query_prefix, display_query, additional_context)
+        )
+        if use_cache:
+            cache_expert_response(full_query, content)
+    else:
+        logger.debug("Using cached expert response")
+        console.print(
+            Panel(_md(content), title="Expert Response", border_style="blue")
+        )
 
-    if related_contents:
-        query_parts.extend(["# Related Files", related_contents])
+    return content
 
-    if formatted_research_notes:
-        query_parts.extend(["# Research Notes", formatted_research_notes])
 
-    if key_snippets and len(key_snippets) > 0:
-        query_parts.extend(["# Key Snippets", key_snippets])
+@tool("ask_experts_batch")
+def ask_experts_batch(questions: List[str]) -> List[str]:
+    """Ask several independent questions to an expert AI model at once.
 
-    if key_facts and len(key_facts) > 0:
-        query_parts.extend(["# Key Facts About This Project", key_facts])
+    Use this instead of calling ask_expert repeatedly when you have multiple questions that do not depend on each other's answers.
 
-    if expert_context["text"]:
-        query_parts.extend(
-            ["\n# Additional Context", "\n".join(expert_context["text"])]
-        )
+    Every question is answered with the same context as ask_expert: key facts, code snippets, related files and any additional context you've provided.
 
-    query_parts.extend(["# Question", question])
-    query_parts.extend(
-        [
-            "\n # Addidional Requirements",
-            "**DO NOT OVERTHINK**",
-            "**DO NOT OVERCOMPLICATE**",
-        ]
-    )
+    Args:
+        questions: The questions to ask, each specific and self-contained
 
-    # Join all parts
-    full_query = "\n".join(query_parts)
+    Returns:
+        The expert's answers, in the same order as the questions
+    """
+    if not questions:
+        return []
 
-    # Get response using full query
-    response = get_model().invoke(full_query)
+    display_queries = ["# Question\n" + question for question in questions]
+    for display_query in display_queries:
+        console.print(
+            Panel(_md(display_query), title="🤔 Expert Query", border_style="yellow")
+        )
 
-    # Format and display response
-    console.print(
-        Panel(Markdown(response.content), title="Expert Response", border_style="blue")
-    )
+    # The shared context is built once for all questions
+    query_prefix, additional_context = build_expert_query_prefix()
+    full_queries = [
+        _join_query(query_prefix, additional_context, display_query)
+        for display_query in display_queries
+    ]
+
+    use_cache = _global_memory.get("config", {}).get("expert_cache", True)
+    responses = [
+        get_cached_expert_response(full_query) if use_cache else None
+        for full_query in full_queries
+    ]
+
+    pending = [i for i, response in enumerate(responses) if response is None]
+    if pending:
+        results = get_model().batch(
+            [
+                build_expert_input(query_prefix, display_queries[i], additional_context)
+                for i in pending
+            ],
+            config={"max_concurrency": EXPERT_BATCH_MAX_CONCURRENCY},
+        )
+        for i, result in zip(pending, results):
+            responses[i] = _chunk_text(result.content)
+            if use_cache:
+                cache_expert_response(full_queries[i], responses[i])
+
+    for response in responses:
+        console.print(
+            Panel(_md(response), title="Expert Response", border_style="blue")
+        )
 
-    return response.content
\ No newline at end of file
+    return responses
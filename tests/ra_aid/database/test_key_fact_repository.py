@@ -258,4 +258,25 @@ def test_get_key_fact_repository_when_not_set(cleanup_repo):
         get_key_fact_repository()
     
     # Verify the correct error message
-    assert "No KeyFactRepository available" in str(excinfo.value)
\ No newline at end of file
+    assert "No KeyFactRepository available" in str(excinfo.value)
+
+def test_revision_increments_on_writes(setup_db):
+    """Test that the revision counter only changes when key facts are modified."""
+    repo = KeyFactRepository(db=setup_db)
+    assert repo.get_revision() == 0
+    
+    fact = repo.create("Test key fact")
+    assert repo.get_revision() == 1
+    
+    repo.get_facts_dict()
+    assert repo.get_revision() == 1
+    
+    repo.update(fact.id, "Updated content")
+    assert repo.get_revision() == 2
+    
+    repo.update(999, "Missing fact")
+    repo.delete(999)
+    assert repo.get_revision() == 2
+    
+    repo.delete(fact.id)
+    assert repo.get_revision() == 3
@@ -301,4 +301,34 @@ def test_get_snippets_dict(setup_db):
         assert snippets_dict[snippet.id]["filepath"] == snippets_data[i]["filepath"]
         assert snippets_dict[snippet.id]["line_number"] == snippets_data[i]["line_number"]
         assert snippets_dict[snippet.id]["snippet"] == snippets_data[i]["snippet"]
-        assert snippets_dict[snippet.id]["description"] == snippets_data[i]["description"]
\ No newline at end of file
+        assert snippets_dict[snippet.id]["description"] == snippets_data[i]["description"]
+
+def test_revision_increments_on_writes(setup_db):
+    """Test that the revision counter only changes when key snippets are modified."""
+    repo = KeySnippetRepository(db=setup_db)
+    assert repo.get_revision() == 0
+
+    key_snippet = repo.create(
+        filepath="/path/to/file.py",
+        line_number=10,
+        snippet="def test_function():",
+        description="Test function definition",
+    )
+    assert repo.get_revision() == 1
+
+    repo.get_snippets_dict()
+    assert repo.get_revision() == 1
+
+    repo.update(
+        key_snippet.id,
+        filepath="/path/to/file.py",
+        line_number=20,
+        snippet="def updated_function():",
+    )
+    assert repo.get_revision() == 2
+
+    repo.delete(999)
+    assert repo.get_revision() == 2
+
+    repo.delete(key_snippet.id)
+    assert repo.get_revision() == 3
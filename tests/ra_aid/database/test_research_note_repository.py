@@ -258,4 +258,25 @@ def test_get_research_note_repository_when_not_set(cleanup_repo):
         get_research_note_repository()
     
     # Verify the correct error message
-    assert "No ResearchNoteRepository available" in str(excinfo.value)
\ No newline at end of file
+    assert "No ResearchNoteRepository available" in str(excinfo.value)
+
+def test_revision_increments_on_writes(setup_db):
+    """Test that the revision counter only changes when research notes are modified."""
+    repo = ResearchNoteRepository(db=setup_db)
+    assert repo.get_revision() == 0
+    
+    note = repo.create("Test research note")
+    assert repo.get_revision() == 1
+    
+    repo.get_notes_dict()
+    assert repo.get_revision() == 1
+    
+    repo.update(note.id, "Updated content")
+    assert repo.get_revision() == 2
+    
+    repo.update(999, "Missing note")
+    repo.delete(999)
+    assert repo.get_revision() == 2
+    
+    repo.delete(note.id)
+    assert repo.get_revision() == 3
@@ -1,13 +1,15 @@
 """Unit tests for agent_utils.py."""
 
+from types import SimpleNamespace
 from typing import Any, Dict, Literal
-from unittest.mock import Mock, patch
+from unittest.mock import Mock
 
-import litellm
 import pytest
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 
+from ra_aid import agent_utils
+from ra_aid.agent_backends.ciayn_agent import CiaynAgent
 from ra_aid.agent_context import (
     agent_context,
 )
@@ -28,12 +30,45 @@ def mock_model():
     return model
 
 
+@pytest.fixture(scope="module")
+def _shared_memory_mock():
+    """Single mock memory store reused by every test in this module."""
+    return Mock()
+
+
 @pytest.fixture
-def mock_memory():
+def mock_memory(_shared_memory_mock, monkeypatch):
     """Fixture providing a mock global memory store."""
-    with patch("ra_aid.agent_utils._global_memory") as mock_mem:
-        mock_mem.get.return_value = {}
-        yield mock_mem
+    _shared_memory_mock.get.return_value = {}
+    monkeypatch.setattr(agent_utils, "_global_memory", _shared_memory_mock)
+    yield _shared_memory_mock
+    _shared_memory_mock.reset_mock(return_value=True, side_effect=True)
+
+
+@pytest.fixture
+def patched_agent_utils(monkeypatch):
+    """Fixture installing mocks for the agent constructors and litellm lookup.
+
+    get_model_info wraps the real lookup until a test sets a return value or side effect.
+    """
+    mocks = SimpleNamespace(
+        create_react_agent=Mock(return_value="react_agent"),
+        CiaynAgent=Mock(return_value="ciayn_agent"),
+        get_model_info=Mock(wraps=agent_utils.get_model_info),
+    )
+    for name, mock in vars(mocks).items():
+        monkeypatch.setattr(agent_utils, name, mock)
+    return mocks
+
+
+@pytest.fixture(autouse=True)
+def clear_token_limit_cache():
+    """Reset cached litellm token limits so each test sees its own mocks."""
+    from ra_aid.agent_utils import _litellm_token_limit
+
+    _litellm_token_limit.cache_clear()
+    yield
+    _litellm_token_limit.cache_clear()
 
 
 def test_get_model_token_limit_anthropic(mock_memory):
@@ -68,36 +103,50 @@ def test_get_model_token_limit_missing_config(mock_memory):
     assert token_limit is None
 
 
-def test_get_model_token_limit_litellm_success():
+def test_get_model_token_limit_litellm_success(patched_agent_utils):
     """Test get_model_token_limit successfully getting limit from litellm."""
     config = {"provider": "anthropic", "model": "claude-2"}
+    patched_agent_utils.get_model_info.return_value = {"max_input_tokens": 100000}
 
-    with patch("ra_aid.agent_utils.get_model_info") as mock_get_info:
-        mock_get_info.return_value = {"max_input_tokens": 100000}
-        token_limit = get_model_token_limit(config, "default")
-        assert token_limit == 100000
+    token_limit = get_model_token_limit(config, "default")
+    assert token_limit == 100000
 
 
-def test_get_model_token_limit_litellm_not_found():
+def test_get_model_token_limit_litellm_not_found(patched_agent_utils):
     """Test fallback to models_tokens when litellm raises NotFoundError."""
+    import litellm
+
     config = {"provider": "anthropic", "model": "claude-2"}
+    patched_agent_utils.get_model_info.side_effect = litellm.exceptions.NotFoundError(
+        message="Model not found", model="claude-2", llm_provider="anthropic"
+    )
 
-    with patch("ra_aid.agent_utils.get_model_info") as mock_get_info:
-        mock_get_info.side_effect = litellm.exceptions.NotFoundError(
-            message="Model not found", model="claude-2", llm_provider="anthropic"
-        )
-        token_limit = get_model_token_limit(config, "default")
-        assert token_limit == models_params["anthropic"]["claude2"]["token_limit"]
+    token_limit = get_model_token_limit(config, "default")
+    assert token_limit == models_params["anthropic"]["claude2"]["token_limit"]
 
 
-def test_get_model_token_limit_litellm_error():
+def test_get_model_token_limit_litellm_error(patched_agent_utils):
     """Test fallback to models_tokens when litellm raises other exceptions."""
     config = {"provider": "anthropic", "model": "claude-2"}
+    patched_agent_utils.get_model_info.side_effect = Exception("Unknown error")
 
-    with patch("ra_aid.agent_utils.get_model_info") as mock_get_info:
-        mock_get_info.side_effect = Exception("Unknown error")
+    token_limit = get_model_token_limit(config, "default")
+    assert token_limit == models_params["anthropic"]["claude2"]["token_limit"]
+
+
+def test_get_model_token_limit_caches_litellm_lookups(patched_agent_utils):
+    """Test that litellm is queried once per model, including failed lookups."""
+    config = {"provider": "anthropic", "model": "claude-2"}
+    mock_get_info = patched_agent_utils.get_model_info
+    mock_get_info.side_effect = Exception("Unknown error")
+
+    for _ in range(3):
         token_limit = get_model_token_limit(config, "default")
         assert token_limit == models_params["anthropic"]["claude2"]["token_limit"]
+    assert mock_get_info.call_count == 1
+
+    get_model_token_limit({"provider": "openai", "model": "gpt-4"}, "default")
+    assert mock_get_info.call_count == 2
 
 
 def test_get_model_token_limit_unexpected_error():
@@ -108,77 +157,70 @@ def test_get_model_token_limit_unexpected_error():
     assert token_limit is None
 
 
-def test_create_agent_anthropic(mock_model, mock_memory):
+def test_create_agent_anthropic(mock_model, mock_memory, patched_agent_utils):
     """Test create_agent with Anthropic Claude model."""
     mock_memory.get.return_value = {"provider": "anthropic", "model": "claude-2"}
 
-    with patch("ra_aid.agent_utils.create_react_agent") as mock_react:
-        mock_react.return_value = "react_agent"
-        agent = create_agent(mock_model, [])
+    agent = create_agent(mock_model, [])
 
-        assert agent == "react_agent"
-        mock_react.assert_called_once_with(
-            mock_model,
-            [],
-            version="v2",
-            state_modifier=mock_react.call_args[1]["state_modifier"],
-        )
+    mock_react = patched_agent_utils.create_react_agent
+    assert agent == "react_agent"
+    mock_react.assert_called_once_with(
+        mock_model,
+        [],
+        version="v2",
+        state_modifier=mock_react.call_args[1]["state_modifier"],
+    )
 
 
-def test_create_agent_openai(mock_model, mock_memory):
+def test_create_agent_openai(mock_model, mock_memory, patched_agent_utils):
     """Test create_agent with OpenAI model."""
     mock_memory.get.return_value = {"provider": "openai", "model": "gpt-4"}
 
-    with patch("ra_aid.agent_utils.CiaynAgent") as mock_ciayn:
-        mock_ciayn.return_value = "ciayn_agent"
-        agent = create_agent(mock_model, [])
+    agent = create_agent(mock_model, [])
 
-        assert agent == "ciayn_agent"
-        mock_ciayn.assert_called_once_with(
-            mock_model,
-            [],
-            max_tokens=models_params["openai"]["gpt-4"]["token_limit"],
-            config={"provider": "openai", "model": "gpt-4"},
-        )
+    assert agent == "ciayn_agent"
+    patched_agent_utils.CiaynAgent.assert_called_once_with(
+        mock_model,
+        [],
+        max_tokens=models_params["openai"]["gpt-4"]["token_limit"],
+        config={"provider": "openai", "model": "gpt-4"},
+    )
 
 
-def test_create_agent_no_token_limit(mock_model, mock_memory):
+def test_create_agent_no_token_limit(mock_model, mock_memory, patched_agent_utils):
     """Test create_agent when no token limit is found."""
     mock_memory.get.return_value = {"provider": "unknown", "model": "unknown-model"}
 
-    with patch("ra_aid.agent_utils.CiaynAgent") as mock_ciayn:
-        mock_ciayn.return_value = "ciayn_agent"
-        agent = create_agent(mock_model, [])
+    agent = create_agent(mock_model, [])
 
-        assert agent == "ciayn_agent"
-        mock_ciayn.assert_called_once_with(
-            mock_model,
-            [],
-            max_tokens=DEFAULT_TOKEN_LIMIT,
-            config={"provider": "unknown", "model": "unknown-model"},
-        )
+    assert agent == "ciayn_agent"
+    patched_agent_utils.CiaynAgent.assert_called_once_with(
+        mock_model,
+        [],
+        max_tokens=DEFAULT_TOKEN_LIMIT,
+        config={"provider": "unknown", "model": "unknown-model"},
+    )
 
 
-def test_create_agent_missing_config(mock_model, mock_memory):
+def test_create_agent_missing_config(mock_model, mock_memory, patched_agent_utils):
     """Test create_agent with missing configuration."""
     mock_memory.get.return_value = {"provider": "openai"}
 
-    with patch("ra_aid.agent_utils.CiaynAgent") as mock_ciayn:
-        mock_ciayn.return_value = "ciayn_agent"
-        agent = create_agent(mock_model, [])
+    agent = create_agent(mock_model, [])
 
-        assert agent == "ciayn_agent"
-        mock_ciayn.assert_called_once_with(
-            mock_model,
-            [],
-            max_tokens=DEFAULT_TOKEN_LIMIT,
-            config={"provider": "openai"},
-        )
+    assert agent == "ciayn_agent"
+    patched_agent_utils.CiaynAgent.assert_called_once_with(
+        mock_model,
+        [],
+        max_tokens=DEFAULT_TOKEN_LIMIT,
+        config={"provider": "openai"},
+    )
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_messages():
-    """Fixture providing mock message objects."""
+    """Fixture providing mock message objects, shared read-only across the module."""
 
     return [
         SystemMessage(content="System prompt"),
@@ -189,41 +231,62 @@ def mock_messages():
     ]
 
 
-def test_state_modifier(mock_messages):
+def test_state_modifier(mock_messages, monkeypatch):
     """Test that state_modifier correctly trims recent messages while preserving the first message when total tokens > max_tokens."""
     state = AgentState(messages=mock_messages)
 
-    with patch(
-        "ra_aid.agent_backends.ciayn_agent.CiaynAgent._estimate_tokens"
-    ) as mock_estimate:
-        mock_estimate.side_effect = lambda msg: 100 if msg else 0
+    monkeypatch.setattr(
+        CiaynAgent, "_estimate_tokens", Mock(side_effect=lambda msg: 100 if msg else 0)
+    )
+
+    result = state_modifier(state, max_input_tokens=250)
 
-        result = state_modifier(state, max_input_tokens=250)
+    assert len(result) < len(mock_messages)
+    assert isinstance(result[0], SystemMessage)
+    assert result[-1] == mock_messages[-1]
 
-        assert len(result) < len(mock_messages)
-        assert isinstance(result[0], SystemMessage)
-        assert result[-1] == mock_messages[-1]
 
+def test_state_modifier_keeps_longest_fitting_suffix(monkeypatch):
+    """Test that state_modifier keeps exactly the recent messages that fit, estimating each once."""
+    messages = [SystemMessage(content="s" * 10)] + [
+        HumanMessage(content="m" * size) for size in (50, 40, 30, 20)
+    ]
+    state = AgentState(messages=messages)
+
+    mock_estimate = Mock(side_effect=lambda msg: len(msg.content))
+    monkeypatch.setattr(CiaynAgent, "_estimate_tokens", mock_estimate)
+
+    # 10 for the first message leaves 50: the last two messages (20 + 30) fit exactly
+    assert state_modifier(state, max_input_tokens=60) == [messages[0]] + messages[-2:]
+    assert mock_estimate.call_count == len(messages)
+
+    # Nothing but the first message fits
+    assert state_modifier(state, max_input_tokens=15) == [messages[0]]
+    assert state_modifier(state, max_input_tokens=5) == [messages[0]]
+
+    # Everything fits
+    assert state_modifier(state, max_input_tokens=1000) == messages
 
-def test_create_agent_with_checkpointer(mock_model, mock_memory):
+
+def test_create_agent_with_checkpointer(mock_model, mock_memory, patched_agent_utils):
     """Test create_agent with checkpointer argument."""
     mock_memory.get.return_value = {"provider": "openai", "model": "gpt-4"}
     mock_checkpointer = Mock()
 
-    with patch("ra_aid.agent_utils.CiaynAgent") as mock_ciayn:
-        mock_ciayn.return_value = "ciayn_agent"
-        agent = create_agent(mock_model, [], checkpointer=mock_checkpointer)
+    agent = create_agent(mock_model, [], checkpointer=mock_checkpointer)
 
-        assert agent == "ciayn_agent"
-        mock_ciayn.assert_called_once_with(
-            mock_model,
-            [],
-            max_tokens=models_params["openai"]["gpt-4"]["token_limit"],
-            config={"provider": "openai", "model": "gpt-4"},
-        )
+    assert agent == "ciayn_agent"
+    patched_agent_utils.CiaynAgent.assert_called_once_with(
+        mock_model,
+        [],
+        max_tokens=models_params["openai"]["gpt-4"]["token_limit"],
+        config={"provider": "openai", "model": "gpt-4"},
+    )
 
 
-def test_create_agent_anthropic_token_limiting_enabled(mock_model, mock_memory):
+def test_create_agent_anthropic_token_limiting_enabled(
+    mock_model, mock_memory, patched_agent_utils, monkeypatch
+):
     """Test create_agent sets up token limiting for Claude models when enabled."""
     mock_memory.get.return_value = {
         "provider": "anthropic",
@@ -231,22 +294,19 @@ def test_create_agent_anthropic_token_limiting_enabled(mock_model, mock_memory):
         "limit_tokens": True,
     }
 
-    with (
-        patch("ra_aid.agent_utils.create_react_agent") as mock_react,
-        patch("ra_aid.agent_utils.get_model_token_limit") as mock_limit,
-    ):
-        mock_react.return_value = "react_agent"
-        mock_limit.return_value = 100000
+    monkeypatch.setattr(agent_utils, "get_model_token_limit", Mock(return_value=100000))
 
-        agent = create_agent(mock_model, [])
+    agent = create_agent(mock_model, [])
 
-        assert agent == "react_agent"
-        args = mock_react.call_args
-        assert "state_modifier" in args[1]
-        assert callable(args[1]["state_modifier"])
+    assert agent == "react_agent"
+    args = patched_agent_utils.create_react_agent.call_args
+    assert "state_modifier" in args[1]
+    assert callable(args[1]["state_modifier"])
 
 
-def test_create_agent_anthropic_token_limiting_disabled(mock_model, mock_memory):
+def test_create_agent_anthropic_token_limiting_disabled(
+    mock_model, mock_memory, patched_agent_utils, monkeypatch
+):
     """Test create_agent doesn't set up token limiting for Claude models when disabled."""
     mock_memory.get.return_value = {
         "provider": "anthropic",
@@ -254,20 +314,17 @@ def test_create_agent_anthropic_token_limiting_disabled(mock_model, mock_memory)
         "limit_tokens": False,
     }
 
-    with (
-        patch("ra_aid.agent_utils.create_react_agent") as mock_react,
-        patch("ra_aid.agent_utils.get_model_token_limit") as mock_limit,
-    ):
-        mock_react.return_value = "react_agent"
-        mock_limit.return_value = 100000
+    monkeypatch.setattr(agent_utils, "get_model_token_limit", Mock(return_value=100000))
 
-        agent = create_agent(mock_model, [])
+    agent = create_agent(mock_model, [])
 
-        assert agent == "react_agent"
-        mock_react.assert_called_once_with(mock_model, [], version="v2")
+    assert agent == "react_agent"
+    patched_agent_utils.create_react_agent.assert_called_once_with(
+        mock_model, [], version="v2"
+    )
 
 
-def test_get_model_token_limit_research(mock_memory):
+def test_get_model_token_limit_research(mock_memory, patched_agent_utils):
     """Test get_model_token_limit with research provider and model."""
     config = {
         "provider": "openai",
@@ -275,13 +332,13 @@ def test_get_model_token_limit_research(mock_memory):
         "research_provider": "anthropic",
         "research_model": "claude-2",
     }
-    with patch("ra_aid.agent_utils.get_model_info") as mock_get_info:
-        mock_get_info.return_value = {"max_input_tokens": 150000}
-        token_limit = get_model_token_limit(config, "research")
-        assert token_limit == 150000
+    patched_agent_utils.get_model_info.return_value = {"max_input_tokens": 150000}
+
+    token_limit = get_model_token_limit(config, "research")
+    assert token_limit == 150000
 
 
-def test_get_model_token_limit_planner(mock_memory):
+def test_get_model_token_limit_planner(mock_memory, patched_agent_utils):
     """Test get_model_token_limit with planner provider and model."""
     config = {
         "provider": "openai",
@@ -289,10 +346,10 @@ def test_get_model_token_limit_planner(mock_memory):
         "planner_provider": "deepseek",
         "planner_model": "dsm-1",
     }
-    with patch("ra_aid.agent_utils.get_model_info") as mock_get_info:
-        mock_get_info.return_value = {"max_input_tokens": 120000}
-        token_limit = get_model_token_limit(config, "planner")
-        assert token_limit == 120000
+    patched_agent_utils.get_model_info.return_value = {"max_input_tokens": 120000}
+
+    token_limit = get_model_token_limit(config, "planner")
+    assert token_limit == 120000
 
 
 # New tests for private helper methods in agent_utils.py
@@ -330,15 +387,10 @@ def test_increment_and_decrement_agent_depth():
     assert _global_memory["agent_depth"] == 10
 
 
-def test_run_agent_stream(monkeypatch):
+def test_run_agent_stream(monkeypatch, streaming_agent_factory):
     from ra_aid.agent_utils import _run_agent_stream
 
-    # Create a dummy agent that yields one chunk
-    class DummyAgent:
-        def stream(self, input_data, cfg: dict):
-            yield {"content": "chunk1"}
-
-    dummy_agent = DummyAgent()
+    dummy_agent, calls = streaming_agent_factory(["chunk1"])
     # Set flags so that _run_agent_stream will reset them
     with agent_context() as ctx:
         ctx.plan_completed = True
@@ -357,6 +409,7 @@ def test_run_agent_stream(monkeypatch):
     )
     _run_agent_stream(dummy_agent, [HumanMessage("dummy prompt")], {})
     assert call_flag["called"]
+    assert calls["stream"] == 1
 
     with agent_context() as ctx:
         assert ctx.plan_completed is False
@@ -397,6 +450,14 @@ def test_handle_api_error_valueerror():
     # ValueError with "quota exceeded" phrase should be handled without raising
     _handle_api_error(ValueError("quota exceeded for this month"), 0, 5, 1)
 
+    # Phrase matching is case-insensitive
+    _handle_api_error(ValueError("Rate Limit reached"), 0, 5, 1)
+
+    # ValueError carrying a 429 status attribute is retried without a phrase
+    error_with_status = ValueError("slow down")
+    error_with_status.status_code = 429
+    _handle_api_error(error_with_status, 0, 5, 1)
+
 
 def test_handle_api_error_status_code():
     from ra_aid.agent_utils import _handle_api_error
@@ -479,33 +540,51 @@ def test_is_anthropic_claude():
     assert not is_anthropic_claude(
         {"provider": "other", "model": "claude-2"}
     )  # Wrong provider
+    assert is_anthropic_claude({"provider": "anthropic", "model": ""}) is False
+    assert not is_anthropic_claude({"provider": None, "model": None})
 
 
-def test_run_agent_with_retry_checks_crash_status(monkeypatch):
-    """Test that run_agent_with_retry checks for crash status at the beginning of each iteration."""
-    from ra_aid.agent_context import agent_context, mark_agent_crashed
-    from ra_aid.agent_utils import run_agent_with_retry
+@pytest.fixture
+def streaming_agent_factory():
+    """Fixture returning make(script) -> (agent, calls) for scripted agent streams.
 
-    # Setup mocks for dependencies to isolate our test
-    dummy_agent = Mock()
+    Each stream() call is counted in calls["stream"] and walks the script, raising
+    exception steps and yielding any other step as a {"content": step} chunk.
+    """
 
-    # Track function calls
-    mock_calls = {"run_agent_stream": 0}
+    def make(script):
+        calls = {"stream": 0}
 
-    def mock_run_agent_stream(*args, **kwargs):
-        mock_calls["run_agent_stream"] += 1
+        class _Agent:
+            def stream(self, input_data, cfg: dict):
+                calls["stream"] += 1
+                for step in script:
+                    if isinstance(step, Exception):
+                        raise step
+                    yield {"content": step}
 
-    def mock_setup_interrupt_handling():
-        return None
+        return _Agent(), calls
 
-    def mock_restore_interrupt_handling(handler):
-        pass
+    return make
 
-    def mock_increment_agent_depth():
-        pass
 
-    def mock_decrement_agent_depth():
-        pass
+@pytest.fixture
+def stub_retry_plumbing(monkeypatch):
+    """Fixture stubbing the interrupt, depth and output plumbing around agent runs."""
+    monkeypatch.setattr(agent_utils, "_setup_interrupt_handling", lambda: None)
+    monkeypatch.setattr(agent_utils, "_restore_interrupt_handling", lambda handler: None)
+    monkeypatch.setattr(agent_utils, "_increment_agent_depth", lambda: None)
+    monkeypatch.setattr(agent_utils, "_decrement_agent_depth", lambda: None)
+    monkeypatch.setattr(agent_utils, "check_interrupt", lambda: None)
+    monkeypatch.setattr(agent_utils, "print_agent_output", lambda chunk, agent_type: None)
+
+
+def test_run_agent_with_retry_checks_crash_status(
+    monkeypatch, streaming_agent_factory, stub_retry_plumbing
+):
+    """Test that run_agent_with_retry checks for crash status at the beginning of each iteration."""
+    from ra_aid.agent_context import agent_context, mark_agent_crashed
+    from ra_aid.agent_utils import run_agent_with_retry
 
     def mock_is_crashed():
         return ctx.is_crashed() if ctx else False
@@ -513,79 +592,42 @@ def test_run_agent_with_retry_checks_crash_status(monkeypatch):
     def mock_get_crash_message():
         return ctx.agent_crashed_message if ctx and ctx.is_crashed() else None
 
-    # Apply mocks
-    monkeypatch.setattr("ra_aid.agent_utils._run_agent_stream", mock_run_agent_stream)
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._setup_interrupt_handling", mock_setup_interrupt_handling
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._restore_interrupt_handling",
-        mock_restore_interrupt_handling,
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._increment_agent_depth", mock_increment_agent_depth
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._decrement_agent_depth", mock_decrement_agent_depth
-    )
-    monkeypatch.setattr("ra_aid.agent_utils.check_interrupt", lambda: None)
-
     # First, run without a crash - agent should be run
+    agent, calls = streaming_agent_factory(["chunk1"])
     with agent_context() as ctx:
         monkeypatch.setattr("ra_aid.agent_context.is_crashed", mock_is_crashed)
         monkeypatch.setattr(
             "ra_aid.agent_context.get_crash_message", mock_get_crash_message
         )
-        result = run_agent_with_retry(dummy_agent, "test prompt", {})
-        assert mock_calls["run_agent_stream"] == 1
-
-    # Reset call counter
-    mock_calls["run_agent_stream"] = 0
+        result = run_agent_with_retry(agent, "test prompt", {})
+        assert calls["stream"] == 1
 
     # Now run with a crash - agent should not be run
+    agent, calls = streaming_agent_factory(["chunk1"])
     with agent_context() as ctx:
         mark_agent_crashed("Test crash message")
         monkeypatch.setattr("ra_aid.agent_context.is_crashed", mock_is_crashed)
         monkeypatch.setattr(
             "ra_aid.agent_context.get_crash_message", mock_get_crash_message
         )
-        result = run_agent_with_retry(dummy_agent, "test prompt", {})
-        # Verify _run_agent_stream was not called
-        assert mock_calls["run_agent_stream"] == 0
+        result = run_agent_with_retry(agent, "test prompt", {})
+        # Verify the agent was not streamed
+        assert calls["stream"] == 0
         # Verify the result contains the crash message
         assert "Agent has crashed: Test crash message" in result
 
 
-def test_run_agent_with_retry_handles_badrequest_error(monkeypatch):
+def test_run_agent_with_retry_handles_badrequest_error(
+    monkeypatch, streaming_agent_factory, stub_retry_plumbing
+):
     """Test that run_agent_with_retry properly handles BadRequestError as unretryable."""
     from ra_aid.agent_context import agent_context, is_crashed
     from ra_aid.agent_utils import run_agent_with_retry
     from ra_aid.exceptions import ToolExecutionError
 
-    # Setup mocks
-    dummy_agent = Mock()
-
-    # Track function calls and simulate BadRequestError
-    run_count = [0]
-
-    def mock_run_agent_stream(*args, **kwargs):
-        run_count[0] += 1
-        if run_count[0] == 1:
-            # First call throws a 400 BadRequestError
-            raise ToolExecutionError("400 Bad Request: Invalid input")
-        # If it's called again, it should run normally
-
-    def mock_setup_interrupt_handling():
-        return None
-
-    def mock_restore_interrupt_handling(handler):
-        pass
-
-    def mock_increment_agent_depth():
-        pass
-
-    def mock_decrement_agent_depth():
-        pass
+    agent, calls = streaming_agent_factory(
+        [ToolExecutionError("400 Bad Request: Invalid input")]
+    )
 
     def mock_mark_agent_crashed(message):
         ctx.agent_has_crashed = True
@@ -594,77 +636,33 @@ def test_run_agent_with_retry_handles_badrequest_error(monkeypatch):
     def mock_is_crashed():
         return ctx.is_crashed() if ctx else False
 
-    # Apply mocks
-    monkeypatch.setattr("ra_aid.agent_utils._run_agent_stream", mock_run_agent_stream)
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._setup_interrupt_handling", mock_setup_interrupt_handling
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._restore_interrupt_handling",
-        mock_restore_interrupt_handling,
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._increment_agent_depth", mock_increment_agent_depth
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._decrement_agent_depth", mock_decrement_agent_depth
-    )
-    monkeypatch.setattr("ra_aid.agent_utils.check_interrupt", lambda: None)
-
     with agent_context() as ctx:
         monkeypatch.setattr(
             "ra_aid.agent_context.mark_agent_crashed", mock_mark_agent_crashed
         )
         monkeypatch.setattr("ra_aid.agent_context.is_crashed", mock_is_crashed)
 
-        result = run_agent_with_retry(dummy_agent, "test prompt", {})
+        result = run_agent_with_retry(agent, "test prompt", {})
         # Verify the agent was only run once and not retried
-        assert run_count[0] == 1
+        assert calls["stream"] == 1
         # Verify the result contains the crash message
         assert "Agent has crashed: Unretryable error" in result
         # Verify the agent is marked as crashed
         assert is_crashed()
 
 
-def test_run_agent_with_retry_handles_api_badrequest_error(monkeypatch):
+def test_run_agent_with_retry_handles_api_badrequest_error(
+    monkeypatch, streaming_agent_factory, stub_retry_plumbing
+):
     """Test that run_agent_with_retry properly handles API BadRequestError as unretryable."""
-    # Import APIError from anthropic module and patch it on the agent_utils module
-
     from ra_aid.agent_context import agent_context, is_crashed
     from ra_aid.agent_utils import run_agent_with_retry
 
-    # Setup mocks
-    dummy_agent = Mock()
-
-    # Track function calls and simulate BadRequestError
-    run_count = [0]
-
     # Create a mock APIError class that simulates Anthropic's APIError
     class MockAPIError(Exception):
         pass
 
-    def mock_run_agent_stream(*args, **kwargs):
-        run_count[0] += 1
-        if run_count[0] == 1:
-            # First call throws a 400 Bad Request APIError
-            mock_error = MockAPIError("400 Bad Request")
-            mock_error.__class__.__name__ = (
-                "APIError"  # Make it look like Anthropic's APIError
-            )
-            raise mock_error
-        # If it's called again, it should run normally
-
-    def mock_setup_interrupt_handling():
-        return None
-
-    def mock_restore_interrupt_handling(handler):
-        pass
-
-    def mock_increment_agent_depth():
-        pass
-
-    def mock_decrement_agent_depth():
-        pass
+    agent, calls = streaming_agent_factory([MockAPIError("400 Bad Request")])
 
     def mock_mark_agent_crashed(message):
         ctx.agent_has_crashed = True
@@ -673,42 +671,134 @@ def test_run_agent_with_retry_handles_api_badrequest_error(monkeypatch):
     def mock_is_crashed():
         return ctx.is_crashed() if ctx else False
 
-    # Apply mocks
-    monkeypatch.setattr("ra_aid.agent_utils._run_agent_stream", mock_run_agent_stream)
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._setup_interrupt_handling", mock_setup_interrupt_handling
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._restore_interrupt_handling",
-        mock_restore_interrupt_handling,
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._increment_agent_depth", mock_increment_agent_depth
-    )
-    monkeypatch.setattr(
-        "ra_aid.agent_utils._decrement_agent_depth", mock_decrement_agent_depth
-    )
-    monkeypatch.setattr("ra_aid.agent_utils.check_interrupt", lambda: None)
-    monkeypatch.setattr("ra_aid.agent_utils._handle_api_error", lambda *args: None)
-    monkeypatch.setattr("ra_aid.agent_utils.APIError", MockAPIError)
+    monkeypatch.setattr(agent_utils, "_handle_api_error", lambda *args: None)
+    monkeypatch.setattr(agent_utils, "APIError", MockAPIError)
     monkeypatch.setattr(
         "ra_aid.agent_context.mark_agent_crashed", mock_mark_agent_crashed
     )
     monkeypatch.setattr("ra_aid.agent_context.is_crashed", mock_is_crashed)
 
     with agent_context() as ctx:
-        result = run_agent_with_retry(dummy_agent, "test prompt", {})
+        result = run_agent_with_retry(agent, "test prompt", {})
         # Verify the agent was only run once and not retried
-        assert run_count[0] == 1
+        assert calls["stream"] == 1
         # Verify the result contains the crash message
         assert "Agent has crashed: Unretryable API error" in result
         # Verify the agent is marked as crashed
         assert is_crashed()
 
+
 def test_handle_api_error_resource_exhausted():
     from google.api_core.exceptions import ResourceExhausted
     from ra_aid.agent_utils import _handle_api_error
     
     # ResourceExhausted exception should be handled without raising
     resource_exhausted_error = ResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
-    _handle_api_error(resource_exhausted_error, 0, 5, 1)
\ No newline at end of file
+    _handle_api_error(resource_exhausted_error, 0, 5, 1)
+
+def test_lazy_rate_limit_errors():
+    from google.api_core.exceptions import ResourceExhausted
+    from litellm.exceptions import RateLimitError as LiteLLMRateLimitError
+
+    from ra_aid.agent_utils import _lazy_rate_limit_errors
+
+    assert set(_lazy_rate_limit_errors()) == {LiteLLMRateLimitError, ResourceExhausted}
+
+
+def test_build_prompt_messages_without_static_prefix():
+    from ra_aid.agent_utils import build_prompt_messages
+
+    messages = build_prompt_messages("dynamic", {"provider": "anthropic", "model": "claude-2"})
+    assert len(messages) == 1
+    assert messages[0].content == "dynamic"
+
+
+def test_build_prompt_messages_anthropic_cache_control():
+    from ra_aid.agent_utils import build_prompt_messages
+
+    config = {"provider": "anthropic", "model": "claude-3-7-sonnet-20250219"}
+    messages = build_prompt_messages("dynamic", config, static_prefix="static")
+
+    assert len(messages) == 1
+    assert isinstance(messages[0], HumanMessage)
+    static_block, dynamic_block = messages[0].content
+    assert static_block["text"] == "static"
+    assert static_block["cache_control"] == {"type": "ephemeral"}
+    assert dynamic_block == {"type": "text", "text": "dynamic"}
+
+
+def test_build_prompt_messages_other_provider_keeps_prefix_first():
+    from ra_aid.agent_utils import build_prompt_messages
+
+    config = {"provider": "openai", "model": "gpt-4"}
+    messages = build_prompt_messages("dynamic", config, static_prefix="static")
+
+    assert len(messages) == 1
+    assert messages[0].content == "static\ndynamic"
+
+
+def test_build_prompt_messages_uses_planner_provider():
+    from ra_aid.agent_utils import build_prompt_messages
+
+    config = {
+        "provider": "anthropic",
+        "model": "claude-3-7-sonnet-20250219",
+        "planner_provider": "openai",
+        "planner_model": "gpt-4",
+    }
+
+    planner = build_prompt_messages(
+        "dynamic", config, static_prefix="static", agent_type="planner"
+    )
+    assert planner[0].content == "static\ndynamic"
+
+    default = build_prompt_messages("dynamic", config, static_prefix="static")
+    assert default[0].content[0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_planning_prompt_static_prefix_has_no_dynamic_slots():
+    from ra_aid.prompts.planning_prompts import (
+        PLANNING_PROMPT_DYNAMIC_SUFFIX,
+        PLANNING_PROMPT_STATIC_PREFIX,
+    )
+
+    for slot in ("{base_task}", "{research_notes}", "{key_facts}", "{key_snippets}", "{work_log}"):
+        assert slot not in PLANNING_PROMPT_STATIC_PREFIX
+        assert slot in PLANNING_PROMPT_DYNAMIC_SUFFIX
+
+
+def test_planning_prompt_templates_match_format():
+    from ra_aid.prompts.planning_prompts import (
+        PLANNING_PROMPT_DYNAMIC_SUFFIX,
+        PLANNING_PROMPT_DYNAMIC_TEMPLATE,
+        PLANNING_PROMPT_STATIC_PREFIX,
+        PLANNING_PROMPT_STATIC_TEMPLATE,
+        _compile_template,
+    )
+
+    static_values = {
+        "expert_section": "expert $HOME",
+        "human_section": "human {x}",
+        "web_research_section": "web",
+    }
+    assert PLANNING_PROMPT_STATIC_TEMPLATE.safe_substitute(
+        static_values
+    ) == PLANNING_PROMPT_STATIC_PREFIX.format(**static_values)
+
+    dynamic_values = {
+        "current_date": "2025-01-01",
+        "working_directory": "/tmp",
+        "base_task": "costs $5 {not a slot}",
+        "project_info": "info",
+        "research_notes": "notes",
+        "related_files": "a.py",
+        "key_facts": "facts",
+        "key_snippets": "snippets",
+        "work_log": "log",
+    }
+    assert PLANNING_PROMPT_DYNAMIC_TEMPLATE.safe_substitute(
+        dynamic_values
+    ) == PLANNING_PROMPT_DYNAMIC_SUFFIX.format(**dynamic_values)
+
+    # Escaped braces and literal dollars survive the conversion
+    assert _compile_template("{{x}} $1 {y}").safe_substitute(y="Y") == "{x} $1 Y"
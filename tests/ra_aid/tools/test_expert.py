@@ -1,11 +1,16 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
 
 from ra_aid.tools.expert import (
+    ask_expert,
+    ask_experts_batch,
+    build_expert_input,
     emit_expert_context,
     expert_context,
     read_files_with_limit,
+    read_related_files,
 )
 
 
@@ -99,22 +104,529 @@ def test_read_files_with_limit_encoding_error(temp_test_files):
 def test_expert_context_management():
     """Test expert context global state management."""
     # Clear any existing context
-    expert_context["text"].clear()
-    expert_context["files"].clear()
+    expert_context.text.clear()
+    expert_context.files.clear()
 
     # Test adding context
     result1 = emit_expert_context.invoke("Test context 1")
     assert "Context added" in result1
-    assert len(expert_context["text"]) == 1
-    assert expert_context["text"][0] == "Test context 1"
+    assert len(expert_context.text) == 1
+    assert list(expert_context.text.values())[0] == "Test context 1"
 
     # Test adding multiple contexts
     result2 = emit_expert_context.invoke("Test context 2")
     assert "Context added" in result2
-    assert len(expert_context["text"]) == 2
-    assert expert_context["text"][1] == "Test context 2"
+    assert len(expert_context.text) == 2
+    assert list(expert_context.text.values())[1] == "Test context 2"
 
     # Test context accumulation
     assert all(
-        ctx in expert_context["text"] for ctx in ["Test context 1", "Test context 2"]
+        ctx in expert_context.text.values()
+        for ctx in ["Test context 1", "Test context 2"]
     )
+
+    # Test that re-emitting identical context is skipped
+    result3 = emit_expert_context.invoke("Test context 1")
+    assert "already added" in result3
+    assert len(expert_context.text) == 2
+
+
+def test_ask_expert_drops_contained_context(mock_expert_model):
+    """Test that context contained in a longer entry is sent only once."""
+    emit_expert_context.invoke("def foo():")
+    emit_expert_context.invoke("def foo():\n    return 1")
+    emit_expert_context.invoke("unrelated note")
+
+    ask_expert.invoke({"question": "What does foo return?"})
+
+    full_query = mock_expert_model.stream.call_args[0][0]
+    assert full_query.count("def foo():") == 1
+    assert "def foo():\n    return 1\nunrelated note" in full_query
+
+
+def test_build_expert_input_anthropic_uses_cache_control():
+    """Test that Claude experts get the static prefix as a cached system block."""
+    config = {"expert_provider": "anthropic", "expert_model": "claude-3-7-sonnet-20250219"}
+    with patch.dict("ra_aid.tools.expert._global_memory", {"config": config}):
+        result = build_expert_input("static prefix", "# Question\nWhy?")
+
+    assert isinstance(result[0], SystemMessage)
+    assert result[0].content[0]["text"] == "static prefix"
+    assert result[0].content[0]["cache_control"] == {"type": "ephemeral"}
+    assert isinstance(result[1], HumanMessage)
+    assert result[1].content == "# Question\nWhy?"
+
+
+def test_build_expert_input_other_provider_returns_string():
+    """Test that non-Claude experts get a single string with the prefix first."""
+    config = {"expert_provider": "openai", "expert_model": "o1"}
+    with patch.dict("ra_aid.tools.expert._global_memory", {"config": config}):
+        result = build_expert_input("static prefix", "# Question\nWhy?")
+
+    assert result == "static prefix\n# Question\nWhy?"
+
+
+@pytest.fixture
+def mock_expert_model():
+    """Patch the expert model and repositories used by ask_expert."""
+    from ra_aid.tools import expert
+
+    expert._expert_response_cache.clear()
+    expert_context.text.clear()
+    mock_model = MagicMock()
+    mock_model.stream.side_effect = lambda _input: iter(
+        [MagicMock(content="ans"), MagicMock(content="wer")]
+    )
+    mock_model.batch.side_effect = lambda inputs, config=None: [
+        MagicMock(content=f"batch answer {i}") for i in range(len(inputs))
+    ]
+    memory = {
+        "config": {"provider": "openai", "model": "gpt-4"},
+        "related_files": {},
+    }
+
+    with (
+        patch.dict("ra_aid.tools.expert._global_memory", memory),
+        patch("ra_aid.tools.expert.get_model", return_value=mock_model),
+        patch(
+            "ra_aid.tools.expert.get_key_fact_repository",
+            side_effect=RuntimeError("no db"),
+        ),
+        patch(
+            "ra_aid.tools.expert.get_key_snippet_repository",
+            side_effect=RuntimeError("no db"),
+        ),
+        patch(
+            "ra_aid.tools.expert.get_research_note_repository",
+            side_effect=RuntimeError("no db"),
+        ),
+    ):
+        yield mock_model
+
+    expert._expert_response_cache.clear()
+
+
+def test_ask_expert_puts_question_last(mock_expert_model):
+    """Test that the expert query starts with static content and ends with the question."""
+    emit_expert_context.invoke("extra context")
+
+    result = ask_expert.invoke({"question": "What is wrong?"})
+
+    assert result == "answer"
+    full_query = mock_expert_model.stream.call_args[0][0]
+    assert full_query.startswith("# Additional Requirements")
+    assert "extra context" in full_query
+    assert full_query.endswith("# Question\nWhat is wrong?")
+    assert expert_context.text == {}
+
+
+def test_ask_expert_claude_checkpoint_excludes_additional_context(mock_expert_model):
+    """Test that emitted context is sent after the cached block, not inside it."""
+    from ra_aid.tools import expert
+
+    expert._global_memory["config"] = {
+        "provider": "anthropic",
+        "model": "claude-3-7-sonnet-20250219",
+    }
+    emit_expert_context.invoke("volatile context")
+
+    ask_expert.invoke({"question": "What is wrong?"})
+
+    system_message, human_message = mock_expert_model.stream.call_args[0][0]
+    cached_block, context_block = system_message.content
+    assert cached_block["cache_control"] == {"type": "ephemeral"}
+    assert cached_block["text"].startswith("# Additional Requirements")
+    assert "volatile context" not in cached_block["text"]
+    assert "cache_control" not in context_block
+    assert "volatile context" in context_block["text"]
+    assert human_message.content == "# Question\nWhat is wrong?"
+
+
+def test_ask_expert_reuses_cached_response(mock_expert_model):
+    """Test that repeating an identical expert query does not call the model again."""
+    first = ask_expert.invoke({"question": "What is wrong?"})
+    second = ask_expert.invoke({"question": "What is wrong?"})
+    ask_expert.invoke({"question": "Something else?"})
+
+    assert first == second == "answer"
+    assert mock_expert_model.stream.call_count == 2
+
+
+def test_ask_expert_cache_disabled(mock_expert_model):
+    """Test that the expert cache can be disabled through config."""
+    from ra_aid.tools.expert import _global_memory
+
+    _global_memory["config"]["expert_cache"] = False
+
+    ask_expert.invoke({"question": "What is wrong?"})
+    ask_expert.invoke({"question": "What is wrong?"})
+
+    assert mock_expert_model.stream.call_count == 2
+
+
+def test_expert_response_cache_evicts_least_recently_used(monkeypatch):
+    """Test that the response cache is bounded and evicts the oldest entry."""
+    from ra_aid.tools import expert
+
+    expert._expert_response_cache.clear()
+    monkeypatch.setattr(expert, "EXPERT_RESPONSE_CACHE_SIZE", 2)
+
+    expert.cache_expert_response("q1", "a1")
+    expert.cache_expert_response("q2", "a2")
+    assert expert.get_cached_expert_response("q1") == "a1"
+    expert.cache_expert_response("q3", "a3")
+
+    assert expert.get_cached_expert_response("q2") is None
+    assert expert.get_cached_expert_response("q1") == "a1"
+    assert expert.get_cached_expert_response("q3") == "a3"
+    expert._expert_response_cache.clear()
+
+
+def test_expert_response_cache_concurrent_access(monkeypatch):
+    """Test that lookups racing with evictions never raise."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ra_aid.tools import expert
+
+    expert._expert_response_cache.clear()
+    monkeypatch.setattr(expert, "EXPERT_RESPONSE_CACHE_SIZE", 2)
+
+    def worker(i):
+        for j in range(500):
+            query = f"q{(i + j) % 5}"
+            expert.cache_expert_response(query, "answer")
+            expert.get_cached_expert_response(query)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(worker, range(8)))
+
+    assert len(expert._expert_response_cache) <= 2
+    expert._expert_response_cache.clear()
+
+
+def test_read_files_with_limit_exact_fit(temp_test_files):
+    """Test that only files past an exactly filled line budget are marked truncated."""
+    tmp_path, files = temp_test_files
+    result = read_files_with_limit([str(files[0]), str(files[1])], max_lines=3)
+
+    assert result == (
+        f"\n## File: {files[0]}\nLine 1\nLine 2\nLine 3\n"
+        f"\n## File: {files[1]}\n\n... truncated after 3 lines ..."
+    )
+
+
+def test_read_files_with_limit_large_file_reads_incrementally(temp_test_files, monkeypatch):
+    """Test that files above the bulk read threshold are still truncated correctly."""
+    from ra_aid.tools import expert
+
+    tmp_path, files = temp_test_files
+    monkeypatch.setattr(expert, "MAX_BULK_READ_BYTES", 0)
+
+    result = read_files_with_limit([str(files[0]), str(files[1])], max_lines=4)
+
+    assert "Line 3\n" in result
+    assert "File 2 Line 1\n" in result
+    assert "File 2 Line 2" not in result
+    assert result.endswith("... truncated after 4 lines ...")
+
+
+def test_read_files_with_limit_preserves_input_order(tmp_path):
+    """Test that concurrently read files are concatenated in the given order."""
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"file{i}.txt"
+        path.write_text(f"content {i}\n")
+        paths.append(str(path))
+
+    result = read_files_with_limit(list(reversed(paths)))
+
+    positions = [result.index(f"content {i}\n") for i in reversed(range(20))]
+    assert positions == sorted(positions)
+
+
+def test_read_related_files_cached_until_file_changes(temp_test_files):
+    """Test that related file contents are reused until a file changes on disk."""
+    import os
+
+    from ra_aid.tools import expert
+
+    tmp_path, files = temp_test_files
+    paths = [str(files[0]), str(files[1])]
+    expert._related_files_cache.clear()
+
+    first = read_related_files(paths)
+    with patch("ra_aid.tools.expert.read_files_with_limit") as mock_read:
+        assert read_related_files(paths) == first
+        mock_read.assert_not_called()
+
+    files[0].write_text("Changed content\n")
+    stat = os.stat(files[0])
+    os.utime(files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    updated = read_related_files(paths)
+    assert "Changed content" in updated
+    assert updated != first
+    expert._related_files_cache.clear()
+
+
+def test_read_related_files_concurrent_eviction(monkeypatch):
+    """Test that concurrent reads evicting from the cache never raise."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ra_aid.tools import expert
+
+    expert._related_files_cache.clear()
+    monkeypatch.setattr(expert, "RELATED_FILES_CACHE_SIZE", 1)
+    monkeypatch.setattr(
+        expert, "read_files_with_limit", lambda paths, max_lines: ",".join(paths)
+    )
+
+    def worker(i):
+        for j in range(200):
+            path = f"missing{(i + j) % 10}.txt"
+            assert read_related_files([path]) == path
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(worker, range(8)))
+
+    assert len(expert._related_files_cache) <= 1
+    expert._related_files_cache.clear()
+
+
+def test_stream_expert_response_joins_text_blocks():
+    """Test that streamed string and content-block chunks are joined into one response."""
+    from ra_aid.tools.expert import stream_expert_response
+
+    mock_model = MagicMock()
+    mock_model.stream.return_value = iter(
+        [
+            MagicMock(content="Hello"),
+            MagicMock(content=[{"type": "text", "text": ", world"}]),
+            MagicMock(content=[{"type": "thinking", "thinking": "hmm"}]),
+        ]
+    )
+
+    with patch("ra_aid.tools.expert.get_model", return_value=mock_model):
+        assert stream_expert_response("query") == "Hello, world"
+
+
+def test_stream_expert_response_parses_markdown_once():
+    """Test that interim updates show raw text and only the final render is Markdown."""
+    from ra_aid.tools import expert
+
+    mock_model = MagicMock()
+    mock_model.stream.return_value = iter(
+        [MagicMock(content="# Title"), MagicMock(content="\nbody")]
+    )
+    expert._md.cache_clear()
+
+    with (
+        patch("ra_aid.tools.expert.get_model", return_value=mock_model),
+        patch("ra_aid.tools.expert.Markdown", wraps=expert.Markdown) as mock_markdown,
+    ):
+        expert.stream_expert_response("query")
+        expert._md("# Title\nbody")
+
+    mock_markdown.assert_called_once_with("# Title\nbody")
+    expert._md.cache_clear()
+
+
+def test_format_repository_section_reuses_until_revision_changes():
+    """Test that formatted repository sections are reused until the repository changes."""
+    from ra_aid.tools import expert
+
+    expert._formatted_sections.clear()
+    repository = MagicMock()
+    repository.get_revision.return_value = 1
+    fetch = MagicMock(return_value={1: "fact"})
+    formatter = MagicMock(side_effect=lambda d: f"formatted {d}")
+
+    first = expert._format_repository_section("facts", repository, fetch, formatter)
+    second = expert._format_repository_section("facts", repository, fetch, formatter)
+    assert first == second
+    assert fetch.call_count == 1
+
+    repository.get_revision.return_value = 2
+    expert._format_repository_section("facts", repository, fetch, formatter)
+    assert fetch.call_count == 2
+
+    other_repository = MagicMock()
+    other_repository.get_revision.return_value = 2
+    expert._format_repository_section("facts", other_repository, fetch, formatter)
+    assert fetch.call_count == 3
+    expert._formatted_sections.clear()
+
+
+def test_ask_experts_batch_shares_prefix(mock_expert_model):
+    """Test that batched questions share one context prefix and keep their order."""
+    emit_expert_context.invoke("shared context")
+
+    result = ask_experts_batch.invoke({"questions": ["First?", "Second?"]})
+
+    assert result == ["batch answer 0", "batch answer 1"]
+    mock_expert_model.batch.assert_called_once()
+    inputs = mock_expert_model.batch.call_args[0][0]
+    assert inputs[0].endswith("# Question\nFirst?")
+    assert inputs[1].endswith("# Question\nSecond?")
+    assert inputs[0].rsplit("# Question", 1)[0] == inputs[1].rsplit("# Question", 1)[0]
+    assert "shared context" in inputs[0]
+    assert mock_expert_model.batch.call_args[1]["config"] == {"max_concurrency": 5}
+    assert expert_context.text == {}
+
+
+def test_ask_experts_batch_skips_cached_questions(mock_expert_model):
+    """Test that questions already answered are not sent to the model again."""
+    cached = ask_expert.invoke({"question": "First?"})
+
+    result = ask_experts_batch.invoke({"questions": ["First?", "Second?"]})
+
+    assert result == [cached, "batch answer 0"]
+    inputs = mock_expert_model.batch.call_args[0][0]
+    assert len(inputs) == 1
+    assert inputs[0].endswith("# Question\nSecond?")
+
+
+def test_ask_experts_batch_empty_keeps_context(mock_expert_model):
+    """Test that an empty batch does not consume the added expert context."""
+    emit_expert_context.invoke("Keep me")
+
+    assert ask_experts_batch.invoke({"questions": []}) == []
+    assert list(expert_context.text.values()) == ["Keep me"]
+    mock_expert_model.batch.assert_not_called()
+
+
+def test_read_files_with_limit_counts_crlf_lines(tmp_path):
+    """Test that Windows line endings are counted as single line breaks."""
+    crlf_file = tmp_path / "crlf.txt"
+    crlf_file.write_bytes(b"one\r\ntwo\r\nthree\r\n")
+
+    result = read_files_with_limit([str(crlf_file)], max_lines=2)
+
+    assert "one" in result
+    assert "two" in result
+    assert "three" not in result
+    assert "truncated" in result
+
+
+def test_read_files_with_limit_translates_newlines(tmp_path):
+    """Test that CRLF and CR line endings reach the prompt as plain newlines."""
+    crlf_file = tmp_path / "crlf.txt"
+    crlf_file.write_bytes(b"one\r\ntwo\rthree\n")
+
+    result = read_files_with_limit([str(crlf_file)])
+
+    assert "\r" not in result
+    assert result.endswith("one\ntwo\nthree\n")
+
+
+def test_get_model_initializes_once_across_threads():
+    """Test that concurrent callers share a single expert model initialization."""
+    import threading
+    import time
+
+    from ra_aid.tools import expert
+
+    def slow_init(provider, model):
+        time.sleep(0.05)
+        return MagicMock(name=f"{provider}/{model}")
+
+    config = {"provider": "openai", "model": "gpt-4o"}
+    with (
+        patch.dict(expert._global_memory, {"config": config}),
+        patch("ra_aid.tools.expert.initialize_expert_llm", side_effect=slow_init) as mock_init,
+        patch.object(expert, "_model_entry", None),
+    ):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(expert.get_model()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert mock_init.call_count == 1
+        assert all(result is results[0] for result in results)
+
+        # Switching the expert model rebuilds the client
+        config["expert_model"] = "o1"
+        assert expert.get_model() is not results[0]
+        assert mock_init.call_count == 2
+        mock_init.assert_called_with("openai", "o1")
+        assert expert._model_entry[0] == ("openai", "o1")
+
+        # A failed initialization clears the cached client
+        mock_init.side_effect = RuntimeError("bad key")
+        config["expert_model"] = "o3"
+        with pytest.raises(RuntimeError):
+            expert.get_model()
+        assert expert._model_entry is None
+
+
+def test_read_files_with_limit_only_counts_newlines(tmp_path):
+    """Test that form feeds and Unicode line separators do not count as lines."""
+    source = tmp_path / "source.py"
+    source.write_text("x = 1\n\x0c\ny = 2\ns = '\u2028'\n", encoding="utf-8")
+
+    result = read_files_with_limit([str(source)], max_lines=4)
+
+    assert "y = 2" in result
+    assert "\u2028" in result
+    assert "truncated" not in result
+
+
+def test_read_files_with_limit_stops_reading_after_budget(tmp_path):
+    """Test that files past the line budget are never read and reads are capped."""
+    from ra_aid.tools import expert
+
+    paths = []
+    for i in range(40):
+        path = tmp_path / f"file{i}.txt"
+        path.write_text("line\n" * 10)
+        paths.append(str(path))
+
+    with patch(
+        "ra_aid.tools.expert._read_file_lines", wraps=expert._read_file_lines
+    ) as mock_read:
+        result = read_files_with_limit(paths, max_lines=15)
+
+    assert result.count("## File:") == 40
+    assert result.count("... truncated after 15 lines ...") == 39
+    assert f"## File: {paths[-1]}\n\n... truncated after 15 lines ..." in result
+    assert mock_read.call_count <= expert.MAX_READ_WORKERS
+    assert all(call.args[1] == 15 for call in mock_read.call_args_list)
+
+    assert expert._read_file_lines(paths[0], 3) == ("line\n" * 10, 10)
+
+
+def test_ask_expert_concurrent_calls_share_console(mock_expert_model):
+    """Test that parallel expert calls do not fight over the live display."""
+    import threading
+
+    barrier = threading.Barrier(2, timeout=5)
+
+    def stream(_input):
+        # Both calls are streaming at the same time before either finishes
+        barrier.wait()
+        return iter([MagicMock(content="ans"), MagicMock(content="wer")])
+
+    mock_expert_model.stream.side_effect = stream
+    results, errors = [], []
+
+    def ask(question):
+        try:
+            results.append(ask_expert.invoke({"question": question}))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=ask, args=(question,)) for question in ("One?", "Two?")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == ["answer", "answer"]